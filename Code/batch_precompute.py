@@ -0,0 +1,167 @@
+"""Headless precomputation of the PinPoint map layers.
+
+Runs the same stage pipeline as the Streamlit app over a grid of parameters in a
+process pool and writes, per parameter combination, one GeoParquet file (the
+displayed columns and geometry) and one compacted, Kepler-ready CSV file per
+layer. The app serves these artifacts directly when the user's settings match a
+precomputed combination.
+
+    python batch_precompute.py --percentiles 50 75 90 --eps 100 200 --spider-km 0.5 1.0
+"""
+import argparse
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import geopandas as gpd
+
+from data_loader import DataLoader
+from instrumentation import configure_logging
+from map_export import build_map_payload, display_layer
+from model_registry import ModelRegistry
+from pinpoint_pipeline import build_pinpoint_pipeline, pipeline_params
+from pipeline_cache import fingerprint
+
+DEFAULT_STATES = "Selangor,W.P. Kuala Lumpur,W.P. Putrajaya"
+MANIFEST = "manifest.json"
+
+# Per-worker loader and pipeline, so combinations handled by one worker share stage results
+_worker = {}
+
+
+def artifact_key(params):
+    """Directory name for a parameter combination (includes the dataset fingerprints, so edits invalidate it)."""
+    return fingerprint(sorted(params.items()))
+
+
+def _layer_file(name, extension):
+    return name.lower().replace(" ", "_") + extension
+
+
+def _init_worker(dataset_dir, cache_dir, lrt_file, stream_population=False):
+    configure_logging()
+    loader = DataLoader(os.path.join(dataset_dir, "administrative_1_state.geojson"),
+                        os.path.join(dataset_dir, "FullPOI_with_KLV.csv"),
+                        os.path.join(dataset_dir, "State_1km_pop_data (Cleaned).csv"),
+                        cache_dir=cache_dir)
+    _worker["loader"] = loader
+    _worker["lrt_file"] = lrt_file
+    # One thread per model: the pool already runs one combination per core
+    model_registry = ModelRegistry(cache_dir, n_jobs=1) if cache_dir else None
+    # No cluster CSV export: workers would all write the same file
+    _worker["pipeline"] = build_pinpoint_pipeline(loader, lrt_file, cache_dir=cache_dir,
+                                                  model_registry=model_registry, cluster_csv=None,
+                                                  stream_population=stream_population)
+
+
+def _precompute_one(output_dir, settings):
+    params = pipeline_params(_worker["loader"], _worker["lrt_file"], **settings)
+    key = artifact_key(params)
+    layers = _worker["pipeline"].run(params, targets=["map"])["map"]
+
+    artifact_dir = os.path.join(output_dir, key)
+    os.makedirs(artifact_dir, exist_ok=True)
+    # Same compaction as the app applies to freshly computed layers
+    datasets, _ = build_map_payload(layers)
+    files = {}
+    for name, dataset in datasets.items():
+        gpd.GeoDataFrame(display_layer(name, layers[name])).to_parquet(
+            os.path.join(artifact_dir, _layer_file(name, ".parquet")))
+        dataset.to_csv(os.path.join(artifact_dir, _layer_file(name, ".csv")), index=False)
+        files[name] = _layer_file(name, "")
+    return {"key": key, "settings": settings, "layers": files}
+
+
+def precompute(dataset_dir, output_dir, grid, cache_dir=None, max_workers=None, stream_population=False):
+    """Precompute every combination in ``grid`` (a dict of setting name -> list of values).
+
+    With ``stream_population`` the hex pyramid is aggregated from the population CSV in chunks.
+    """
+    lrt_file = os.path.join(dataset_dir, "lrt-malaysia.csv")
+    names = list(grid)
+    combinations = [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+    print(f"🔹 Precomputing {len(combinations)} parameter combinations...")
+
+    os.makedirs(output_dir, exist_ok=True)
+    workers = max_workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(dataset_dir, cache_dir, lrt_file, stream_population)) as pool:
+        # Neighbouring combinations share upstream stages, so hand them to the same worker
+        entries = list(pool.map(_precompute_one, itertools.repeat(output_dir), combinations,
+                                chunksize=max(1, len(combinations) // (4 * workers))))
+
+    # Keep artifacts from earlier runs with other grids in the manifest
+    manifest = {entry["key"]: entry for entry in _read_manifest(output_dir)}
+    manifest.update((entry["key"], entry) for entry in entries)
+    with open(os.path.join(output_dir, MANIFEST), "w") as f:
+        json.dump(list(manifest.values()), f, indent=2)
+    print(f"✅ Wrote {len(entries)} artifact sets to {output_dir}")
+    return entries
+
+
+def _read_manifest(output_dir):
+    manifest_path = os.path.join(output_dir, MANIFEST)
+    if not os.path.exists(manifest_path):
+        return []
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def load_precomputed(output_dir, params, as_payload=True):
+    """Layers precomputed for ``params`` (from ``pipeline_params``), or None if there is no artifact.
+
+    With ``as_payload`` the layers are the compacted CSV strings, ready to hand to Kepler.gl;
+    otherwise they are GeoDataFrames of the displayed columns.
+    """
+    key = artifact_key(params)
+    artifact_dir = os.path.join(output_dir, key)
+    if not os.path.isdir(artifact_dir):
+        return None
+
+    entry = next((entry for entry in _read_manifest(output_dir) if entry["key"] == key), None)
+    if entry is None:
+        return None
+
+    layers = {}
+    for name, stem in entry["layers"].items():
+        if as_payload:
+            with open(os.path.join(artifact_dir, stem + ".csv")) as f:
+                layers[name] = f.read()
+        else:
+            layers[name] = gpd.read_parquet(os.path.join(artifact_dir, stem + ".parquet"))
+    return layers
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute PinPoint AI map layers for a grid of parameters.")
+    parser.add_argument("--dataset-dir", default="Dataset")
+    parser.add_argument("--output-dir", default=os.path.join("Dataset", "precomputed"))
+    parser.add_argument("--cache-dir", default=os.path.join("Dataset", ".cache"))
+    parser.add_argument("--percentiles", type=int, nargs="+", default=[75])
+    parser.add_argument("--eps", type=int, nargs="+", default=[100], help="Clustering radius in meters")
+    parser.add_argument("--spider-km", type=float, nargs="+", default=[0.5])
+    parser.add_argument("--hex-resolutions", type=int, nargs="+", default=[7])
+    parser.add_argument("--scorers", nargs="+", default=["threshold"])
+    parser.add_argument("--states", nargs="+", default=[DEFAULT_STATES],
+                        help="State selections, each a comma-separated list of state names")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--stream-population", action="store_true",
+                        help="Aggregate the hex pyramid from the population CSV in chunks")
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    grid = {
+        "target_states": [tuple(state.strip() for state in selection.split(",")) for selection in args.states],
+        "percentile": args.percentiles,
+        "scorer": args.scorers,
+        "hex_resolution": args.hex_resolutions,
+        "eps_meters": args.eps,
+        "spider_km": args.spider_km
+    }
+    precompute(args.dataset_dir, args.output_dir, grid, cache_dir=args.cache_dir, max_workers=args.workers,
+               stream_population=args.stream_population)
+
+
+if __name__ == "__main__":
+    main()
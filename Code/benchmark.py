@@ -0,0 +1,375 @@
+"""Benchmarks of the PinPoint pipeline stages on synthetic data.
+
+Generates POIs, population grid cells and LRT stations of configurable sizes over the
+Selangor bounding box, times every stage (best of ``--repeats`` cold runs), records its
+peak traced memory, and writes the results per size as JSON so runs on different
+commits can be compared. Helpers added after the original app are optional, so the
+script also runs on older commits through their original entry points:
+
+    python Code/benchmark.py --sizes 1000 10000 100000 --output benchmark.json
+    python Code/benchmark.py --sizes 1000 10000 100000 --compare benchmark.json
+"""
+import argparse
+import inspect
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+import streamlitDBSCAN
+from data_loader import DataLoader
+from poi_layer import POIProcessor
+from streamlitDBSCAN import POIClustering
+from streamlitHexbin import HexbinGenerator
+from streamlitSpider import SpiderMapLayer
+
+try:
+    import h3_index
+    from dataset_registry import registry
+except ImportError:  # Older commits have no shared caches to clear
+    h3_index = registry = None
+try:
+    from pinpoint_pipeline import MAX_EPS_METERS, build_scorer
+except ImportError:  # Older commits train the random forest in the app
+    MAX_EPS_METERS = build_scorer = None
+try:
+    from instrumentation import configure_logging
+except ImportError:  # Older commits print instead of logging
+    configure_logging = None
+try:
+    from region_index import RegionIndex
+except ImportError:
+    RegionIndex = None
+try:
+    from data_loader import POPULATION_COLUMNS
+except ImportError:
+    POPULATION_COLUMNS = [
+        "Lat", "Lon", "state", "parlimen", "dun", "population_every_1km2",
+        "ethnicity_proportion_bumi", "ethnicity_proportion_chinese", "ethnicity_proportion_indian",
+        "age_proportion_0_14", "age_proportion_15_64", "age_proportion_18_above", "age_proportion_65_above",
+        "income_avg", "expenditure_avg"
+    ]
+
+BENCHMARK_STATE = "Selangor"
+BRANDS = ["7-Eleven", "KFC", "McDonald's", "Starbucks", "Pizza Hut", "ZUS Coffee", "Tealive", "MyNews"]
+CLUSTERED_SHARE = 0.7  # Share of POIs placed around cluster centres, the rest are spread uniformly
+CLUSTER_SPREAD_DEG = 0.002  # ~200 m
+PARLIMEN_BINS = 8
+DUN_BINS = 4  # Per parlimen
+FEATURE_COLUMNS = [
+    "population_every_1km2", "income_avg", "expenditure_avg",
+    "ethnicity_proportion_bumi", "ethnicity_proportion_chinese", "ethnicity_proportion_indian",
+    "age_proportion_0_14", "age_proportion_15_64", "age_proportion_18_above", "age_proportion_65_above"
+]
+
+
+def state_bounds(state_geojson, state=BENCHMARK_STATE):
+    """(minx, miny, maxx, maxy) of a state in the administrative boundaries file."""
+    gdf_states = gpd.read_file(state_geojson).to_crs("EPSG:4326")
+    return tuple(gdf_states[gdf_states["state"] == state].total_bounds)
+
+
+def _electoral_labels(lon, lat, bounds):
+    # Parlimen by longitude band and dun by latitude band inside it, so labels are spatially coherent
+    minx, miny, maxx, maxy = bounds
+    parlimen = np.clip(((lon - minx) / (maxx - minx) * PARLIMEN_BINS).astype(int), 0, PARLIMEN_BINS - 1)
+    dun = parlimen * DUN_BINS + np.clip(((lat - miny) / (maxy - miny) * DUN_BINS).astype(int), 0, DUN_BINS - 1)
+    parlimen_names = np.array([f"P.{90 + i:03d} Synthetic" for i in range(PARLIMEN_BINS)], dtype=object)
+    dun_names = np.array([f"N.{1 + i:02d} Synthetic" for i in range(PARLIMEN_BINS * DUN_BINS)], dtype=object)
+    return parlimen_names[parlimen], dun_names[dun]
+
+
+def synthetic_dataset(output_dir, n_poi, n_population, n_stations, bounds, state=BENCHMARK_STATE, seed=42):
+    """Write POI, population grid and LRT CSVs in the layout of the real datasets; returns their paths."""
+    rng = np.random.default_rng(seed)
+    minx, miny, maxx, maxy = bounds
+
+    def uniform(n):
+        return rng.uniform(miny, maxy, n), rng.uniform(minx, maxx, n)
+
+    # POIs: dense groups around random centres (so DBSCAN finds clusters) plus uniform background
+    n_clustered = int(n_poi * CLUSTERED_SHARE)
+    centre_lat, centre_lon = uniform(max(1, n_clustered // 20))
+    centre = rng.integers(0, len(centre_lat), n_clustered)
+    background_lat, background_lon = uniform(n_poi - n_clustered)
+    poi_lat = np.concatenate([centre_lat[centre] + rng.normal(0, CLUSTER_SPREAD_DEG, n_clustered), background_lat])
+    poi_lon = np.concatenate([centre_lon[centre] + rng.normal(0, CLUSTER_SPREAD_DEG, n_clustered), background_lon])
+    poi_parlimen, poi_dun = _electoral_labels(poi_lon, poi_lat, bounds)
+    brands = rng.choice(BRANDS, n_poi)
+    tiers = rng.integers(1, 4, n_poi)
+    df_poi = pd.DataFrame({
+        "Rank": "CVS",
+        "Brand": brands,
+        "Name": [f"{brand} #{i}" for i, brand in enumerate(brands)],
+        "Latitude": poi_lat,
+        "Longitude": poi_lon,
+        "Address": "",
+        "POI_state": state,
+        "parlimen": poi_parlimen,
+        "dun": poi_dun,
+        "Tier": tiers,
+        "Points": tiers
+    })
+
+    # Population grid: one row per cell, with the columns read by DataLoader
+    lat, lon = uniform(n_population)
+    parlimen, dun = _electoral_labels(lon, lat, bounds)
+    ethnicity = rng.dirichlet([6, 3, 1], n_population)
+    age = rng.dirichlet([2, 7, 1], n_population)
+    df_population = pd.DataFrame({
+        "Lat": lat,
+        "Lon": lon,
+        "state": state,
+        "parlimen": parlimen,
+        "dun": dun,
+        "population_every_1km2": rng.lognormal(6, 1.2, n_population).round(),
+        "ethnicity_proportion_bumi": ethnicity[:, 0],
+        "ethnicity_proportion_chinese": ethnicity[:, 1],
+        "ethnicity_proportion_indian": ethnicity[:, 2],
+        "age_proportion_0_14": age[:, 0],
+        "age_proportion_15_64": age[:, 1],
+        "age_proportion_18_above": age[:, 1] + age[:, 2],
+        "age_proportion_65_above": age[:, 2],
+        "income_avg": rng.normal(8000, 2500, n_population).clip(1000),
+        "expenditure_avg": rng.normal(5000, 1500, n_population).clip(500),
+        "year": 2020
+    }, columns=POPULATION_COLUMNS + ["year"])
+
+    station_lat, station_lon = uniform(n_stations)
+    df_lrt = pd.DataFrame({
+        "station_name": [f"Synthetic station {i}" for i in range(n_stations)],
+        "location": "",
+        "type": rng.choice(["LRT", "MRT"], n_stations),
+        "latitude": station_lat,
+        "longitude": station_lon
+    })
+
+    paths = {
+        "poi_csv": os.path.join(output_dir, "poi.csv"),
+        "population_csv": os.path.join(output_dir, "population.csv"),
+        "lrt_file": os.path.join(output_dir, "lrt.csv")
+    }
+    df_poi.to_csv(paths["poi_csv"], index=False)
+    df_population.to_csv(paths["population_csv"], index=False)
+    df_lrt.to_csv(paths["lrt_file"], index=False)
+    return paths
+
+
+def clear_caches():
+    """Drop the process-wide caches so every measured run starts cold."""
+    if registry is not None:
+        registry.clear()
+    for cache in (getattr(streamlitDBSCAN, "_graph_cache", None), getattr(streamlitDBSCAN, "_population_trees", None),
+                  getattr(h3_index, "_boundary_cache", None)):
+        if cache is not None:
+            cache.clear()
+
+
+def _accepts(func, parameter):
+    return parameter in inspect.signature(func).parameters
+
+
+def _original_model(gdf_population, percentile):
+    # The random forest the original app trained before scorers were introduced
+    from sklearn.ensemble import RandomForestClassifier
+    X_train = gdf_population[FEATURE_COLUMNS].fillna(gdf_population[FEATURE_COLUMNS].median())
+    y_train = (X_train["population_every_1km2"] > np.percentile(X_train["population_every_1km2"], percentile)).astype(int)
+    return RandomForestClassifier(n_estimators=200, random_state=42).fit(X_train, y_train)
+
+
+def measure(func, repeats=3):
+    """Run ``func`` cold ``repeats`` times; returns (result, best seconds, peak traced MiB of one extra run).
+
+    Memory is measured in a separate run because tracing slows allocations down.
+    Only allocations made through Python and NumPy are traced (not GEOS or h3 internals).
+    """
+    seconds = []
+    for _ in range(repeats):
+        clear_caches()
+        start = time.perf_counter()
+        result = func()
+        seconds.append(time.perf_counter() - start)
+
+    clear_caches()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, min(seconds), peak / 2 ** 20
+
+
+def _rows(result):
+    return len(result) if hasattr(result, "__len__") and not isinstance(result, (tuple, str)) else None
+
+
+def benchmark_stages(state_geojson, paths, scorer="random_forest", percentile=75, eps_meters=100, spider_km=0.5,
+                     hex_resolution=7, repeats=3):
+    """Time the PinPoint stages on one dataset; returns one row per stage.
+
+    On commits without ``build_scorer`` the model is the original random forest, whatever ``scorer`` is.
+    Other scorers time as ``model_training[<scorer>]``, so ``compare`` never sets them against a forest.
+    """
+    rows = []
+
+    def run(stage, func, rows_in=None):
+        result, seconds, peak_mb = measure(func, repeats)
+        rows.append({"stage": stage, "seconds": seconds, "peak_mb": peak_mb, "rows_in": rows_in,
+                     "rows_out": _rows(result)})
+        print(f"   {stage:<26} {seconds:8.3f} s  {peak_mb:8.1f} MiB")
+        return result
+
+    loader = DataLoader(state_geojson, paths["poi_csv"], paths["population_csv"])
+    gdf_poi, gdf_population, gdf_states = run(
+        "load_data", lambda: DataLoader(state_geojson, paths["poi_csv"], paths["population_csv"]).load_data())
+    gdf_selected_states = gdf_states[gdf_states["state"] == BENCHMARK_STATE]
+
+    processor = POIProcessor(hex_resolution=hex_resolution)
+    filter_kwargs = {"region_index": RegionIndex(gdf_states)} if RegionIndex is not None else {}
+    filtered_poi = run("filter_pois", lambda: processor.filter_pois(gdf_poi, gdf_selected_states, **filter_kwargs),
+                       len(gdf_poi))
+    hex_poi = run("assign_poi_to_hex", lambda: processor.assign_poi_to_hex(filtered_poi.copy()), len(filtered_poi))
+
+    if build_scorer is not None:
+        stage = "model_training" if scorer == "random_forest" else f"model_training[{scorer}]"
+        model = run(stage, lambda: build_scorer(loader, gdf_population, percentile, scorer), len(gdf_population))
+    else:
+        model = run("model_training", lambda: _original_model(gdf_population, percentile), len(gdf_population))
+    generator = HexbinGenerator(loader, model, hex_resolution=hex_resolution)
+    if _accepts(generator.generate_hexbins_with_ml, "gdf_population"):
+        generate_hexbins = lambda: generator.generate_hexbins_with_ml(gdf_population)
+    else:
+        generate_hexbins = generator.generate_hexbins_with_ml  # Reloads the datasets itself
+    run("generate_hexbins_with_ml", generate_hexbins, len(gdf_population))
+
+    if _accepts(POIClustering, "eps_meters"):
+        clustering = POIClustering(eps_meters=eps_meters, max_eps_meters=MAX_EPS_METERS or eps_meters, output_csv=None)
+    else:
+        clustering = POIClustering(eps_distance=eps_meters / 111000, output_csv=None)
+    clustered_poi = run("cluster_pois", lambda: clustering.cluster_pois(hex_poi.copy()), len(hex_poi))
+    cluster_polygons = run("generate_cluster_polygons",
+                           lambda: clustering.generate_cluster_polygons(clustered_poi, gdf_population),
+                           len(clustered_poi))
+
+    if _accepts(SpiderMapLayer, "commercial_hubs"):
+        hubs = {"commercial_hubs": cluster_polygons}
+    else:
+        # Older commits read the hubs back from the cluster CSV
+        commercial_csv = os.path.join(os.path.dirname(paths["lrt_file"]), "clusters.csv")
+        pd.DataFrame(cluster_polygons.drop(columns="geometry", errors="ignore")).to_csv(commercial_csv, index=False)
+        hubs = {"commercial_file": commercial_csv}
+
+    def spider():
+        # Includes reading the station CSV, as the app does on every spider rerun
+        spider_layer = SpiderMapLayer(paths["lrt_file"], max_distance_km=spider_km, **hubs)
+        spider_layer.load_data()
+        return spider_layer.generate_spider_outputs()[0]
+
+    run("generate_spider_outputs", spider, len(cluster_polygons))
+    return rows
+
+
+def scaling_exponents(results):
+    """Log-log slope of seconds against size per stage (1 = linear, 2 = quadratic)."""
+    df = pd.DataFrame(results)
+    exponents = {}
+    for stage, group in df.groupby("stage", sort=False):
+        group = group[group["seconds"] > 0]
+        if group["size"].nunique() >= 2:
+            exponents[stage] = round(float(np.polyfit(np.log(group["size"]), np.log(group["seconds"]), 1)[0]), 3)
+    return exponents
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(state_geojson, sizes, population_ratio=2.0, station_ratio=0.005, seed=42, **settings):
+    """Benchmark every size (number of POIs) and return the JSON-ready report."""
+    bounds = state_bounds(state_geojson)
+    results = []
+    for size in sizes:
+        n_population = max(1, int(size * population_ratio))
+        n_stations = max(10, int(size * station_ratio))
+        print(f"🔹 {size} POIs, {n_population} population cells, {n_stations} stations")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = synthetic_dataset(tmp_dir, size, n_population, n_stations, bounds, seed=seed)
+            for row in benchmark_stages(state_geojson, paths, **settings):
+                results.append({"size": size, "n_population": n_population, "n_stations": n_stations, **row})
+
+    return {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {"population_ratio": population_ratio, "station_ratio": station_ratio, "seed": seed, **settings},
+        "results": results,
+        "scaling_exponents": scaling_exponents(results)
+    }
+
+
+def compare(report, baseline, tolerance=0.2):
+    """Per (size, stage) timing ratio against a baseline report; ``regression`` marks slowdowns beyond ``tolerance``."""
+    current = pd.DataFrame(report["results"]).set_index(["size", "stage"])
+    previous = pd.DataFrame(baseline["results"]).set_index(["size", "stage"])
+    joined = current[["seconds", "peak_mb"]].join(previous[["seconds", "peak_mb"]], rsuffix="_baseline", how="inner")
+    joined["speedup"] = joined["seconds_baseline"] / joined["seconds"]
+    joined["memory_ratio"] = joined["peak_mb"] / joined["peak_mb_baseline"]
+    joined["regression"] = joined["seconds"] > joined["seconds_baseline"] * (1 + tolerance)
+    return joined.reset_index()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the PinPoint AI pipeline stages on synthetic data.")
+    parser.add_argument("--dataset-dir", default="Dataset", help="Directory with administrative_1_state.geojson")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000], help="Numbers of POIs")
+    parser.add_argument("--population-ratio", type=float, default=2.0, help="Population cells per POI")
+    parser.add_argument("--station-ratio", type=float, default=0.005, help="Stations per POI (at least 10)")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--scorer", default="random_forest",
+                        help="Suitability scorer; only random_forest is comparable with older commits")
+    parser.add_argument("--percentile", type=int, default=75)
+    parser.add_argument("--eps", type=int, default=100, help="Clustering radius in meters")
+    parser.add_argument("--spider-km", type=float, default=0.5)
+    parser.add_argument("--hex-resolution", type=int, default=7)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", default=None, help="Baseline JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before flagging a regression")
+    args = parser.parse_args(argv)
+    if configure_logging is not None:
+        configure_logging()
+
+    report = run_benchmark(os.path.join(args.dataset_dir, "administrative_1_state.geojson"), args.sizes,
+                           population_ratio=args.population_ratio, station_ratio=args.station_ratio, seed=args.seed,
+                           scorer=args.scorer, percentile=args.percentile, eps_meters=args.eps,
+                           spider_km=args.spider_km, hex_resolution=args.hex_resolution, repeats=args.repeats)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Wrote benchmark report to {args.output}")
+    print(f"🔹 Scaling exponents: {report['scaling_exponents']}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            comparison = compare(report, json.load(f), args.tolerance)
+        print(comparison.to_string(index=False))
+        if comparison["regression"].any():
+            print(f"⚠️ {int(comparison['regression'].sum())} stage timings regressed beyond {args.tolerance:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
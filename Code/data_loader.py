@@ -1,34 +1,225 @@
+import hashlib
+import json
+import os
+import tempfile
+
 import pandas as pd
 import geopandas as gpd
 import chardet
 
+from dataset_registry import registry as default_registry
+from h3_index import DEFAULT_RESOLUTIONS, MultiResolutionIndex
+from hex_pyramid import HexPyramid, aggregate_cells, merge_partials
+from instrumentation import count, get_logger, traced
+from pipeline_cache import write_atomic
+
+logger = get_logger("data_loader")
+
+# Population grid columns actually used downstream (hexbins, model, clustering)
+POPULATION_COLUMNS = [
+    "Lat", "Lon", "state", "parlimen", "dun", "population_every_1km2",
+    "ethnicity_proportion_bumi", "ethnicity_proportion_chinese", "ethnicity_proportion_indian",
+    "age_proportion_0_14", "age_proportion_15_64", "age_proportion_18_above", "age_proportion_65_above",
+    "income_avg", "expenditure_avg"
+]
+
+# Compact dtypes for streamed population chunks; coordinates stay float64 so points keep their H3 cells
+CATEGORY_COLUMNS = ["state", "parlimen", "dun"]
+COORDINATE_COLUMNS = ["Lat", "Lon"]
+POPULATION_DTYPES = {col: ("category" if col in CATEGORY_COLUMNS else "float64" if col in COORDINATE_COLUMNS
+                           else "float32") for col in POPULATION_COLUMNS}
+
+FINGERPRINT_SAMPLE_BYTES = 1024 * 1024
+POPULATION_CHUNK_ROWS = 200000
+
+
+def file_fingerprint(file_path):
+    """Cheap content fingerprint: size + mtime + hash of the head and tail of the file."""
+    stat = os.stat(file_path)
+    digest = hashlib.sha1(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    with open(file_path, "rb") as f:
+        digest.update(f.read(FINGERPRINT_SAMPLE_BYTES))
+        if stat.st_size > 2 * FINGERPRINT_SAMPLE_BYTES:
+            f.seek(-FINGERPRINT_SAMPLE_BYTES, os.SEEK_END)
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
 class DataLoader:
-    def __init__(self, state_geojson, poi_csv=None, population_csv=None):
+    def __init__(self, state_geojson, poi_csv=None, population_csv=None, cache_dir=None,
+                 population_columns=POPULATION_COLUMNS, registry=default_registry):
         self.state_geojson = state_geojson
         self.poi_csv = poi_csv
         self.population_csv = population_csv
+        self.cache_dir = cache_dir  # Columnar cache is only used when a directory is given
+        self.population_columns = population_columns
+        self.registry = registry
+        self._encodings = {}
 
     def detect_encoding(self, file_path):
         if file_path is None:
             return None  # Skip if no file
-        with open(file_path, "rb") as f:
-            result = chardet.detect(f.read(100000))
-            return result["encoding"]
 
-    def load_data(self):
-        print("🔹 Loading Datasets...")
+        fingerprint = file_fingerprint(file_path)
+        if fingerprint in self._encodings:
+            return self._encodings[fingerprint]
+
+        encodings = self._read_encoding_memo()
+        if fingerprint not in encodings:
+            with open(file_path, "rb") as f:
+                encodings[fingerprint] = chardet.detect(f.read(100000))["encoding"]
+            self._write_encoding_memo(encodings)
+
+        self._encodings[fingerprint] = encodings[fingerprint]
+        return encodings[fingerprint]
+
+    def _read_encoding_memo(self):
+        if not self.cache_dir:
+            return {}
+        memo_path = os.path.join(self.cache_dir, "encodings.json")
+        if not os.path.exists(memo_path):
+            return {}
+        with open(memo_path) as f:
+            return json.load(f)
+
+    def _write_encoding_memo(self, encodings):
+        if not self.cache_dir:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(os.path.join(self.cache_dir, "encodings.json"), "w") as f:
+            json.dump(encodings, f, indent=2)
+
+    def _cache_path(self, name, file_path):
+        return os.path.join(self.cache_dir, f"{name}-{file_fingerprint(file_path)}.parquet")
+
+    def _load_shared(self, name, file_path, read_source, columns=None):
+        """Load a dataset once per process through the registry (results are shared, do not mutate)."""
+        key = (name, file_path, file_fingerprint(file_path), tuple(columns or ()), self.cache_dir)
+        return self.registry.get(key, lambda: self._load_cached(name, file_path, read_source, columns))
+
+    def _load_cached(self, name, file_path, read_source, columns=None):
+        """Read a GeoDataFrame from the columnar cache, parsing the source file on a miss.
 
-        gdf_states = gpd.read_file(self.state_geojson).to_crs("EPSG:4326")
+        Only ``columns`` (plus geometry) are returned, with or without a cache directory.
+        """
+        if columns is not None:
+            columns = list(columns) + ["geometry"]
+        if not self.cache_dir:
+            gdf = read_source()
+            return gdf[columns] if columns is not None else gdf
+
+        cache_path = self._cache_path(name, file_path)
+
+        if os.path.exists(cache_path):
+            logger.info(f"🔹 Reading {name} from cache {cache_path}")
+            count("parquet_cache_hits")
+            return gpd.read_parquet(cache_path, columns=columns)
+
+        gdf = read_source()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Drop cache files written for older versions of the same source (other processes may be sweeping too)
+        for stale in os.listdir(self.cache_dir):
+            stale_path = os.path.join(self.cache_dir, stale)
+            if stale.startswith(f"{name}-") and stale.endswith(".parquet") and stale_path != cache_path:
+                try:
+                    os.remove(stale_path)
+                except FileNotFoundError:
+                    pass
+        write_atomic(cache_path, lambda tmp_path: gdf.to_parquet(tmp_path, index=False))
+        logger.info(f"✅ Cached {name} to {cache_path}")
+        return gdf[columns] if columns is not None else gdf
+
+    def _read_states(self):
+        return gpd.read_file(self.state_geojson).to_crs("EPSG:4326")
+
+    def _read_poi(self):
+        encoding = self.detect_encoding(self.poi_csv)
+        df_poi = pd.read_csv(self.poi_csv, encoding=encoding)
+        return gpd.GeoDataFrame(df_poi, geometry=gpd.points_from_xy(df_poi["Longitude"], df_poi["Latitude"]), crs="EPSG:4326")
+
+    def _read_population(self):
+        df_population = pd.read_csv(self.population_csv)
+        return gpd.GeoDataFrame(df_population, geometry=gpd.points_from_xy(df_population["Lon"], df_population["Lat"]), crs="EPSG:4326")
+
+    @traced("DataLoader.load_data")
+    def load_data(self, include_population=True):
+        """(POIs, population grid, states); pass ``include_population=False`` to skip the grid (None)."""
+        logger.info("🔹 Loading Datasets...")
+
+        gdf_states = self._load_shared("states", self.state_geojson, self._read_states)
 
         gdf_poi = None
         if self.poi_csv:
-            encoding = self.detect_encoding(self.poi_csv)
-            df_poi = pd.read_csv(self.poi_csv, encoding=encoding)
-            gdf_poi = gpd.GeoDataFrame(df_poi, geometry=gpd.points_from_xy(df_poi["Longitude"], df_poi["Latitude"]), crs="EPSG:4326")
+            gdf_poi = self._load_shared("poi", self.poi_csv, self._read_poi)
 
         gdf_population = None
-        if self.population_csv:
-            df_population = pd.read_csv(self.population_csv)
-            gdf_population = gpd.GeoDataFrame(df_population, geometry=gpd.points_from_xy(df_population["Lon"], df_population["Lat"]), crs="EPSG:4326")
+        if self.population_csv and include_population:
+            gdf_population = self._load_shared("population", self.population_csv, self._read_population,
+                                               columns=self.population_columns)
 
+        count("state_rows", len(gdf_states))
+        count("poi_rows", len(gdf_poi) if gdf_poi is not None else 0)
+        count("population_rows", len(gdf_population) if gdf_population is not None else 0)
         return gdf_poi, gdf_population, gdf_states
+
+    @traced("DataLoader.read_population")
+    def read_population(self):
+        """The population grid as a compact table: used columns only, ``POPULATION_DTYPES``, no geometry.
+
+        Shared per process like ``load_data`` (do not mutate).
+        """
+        key = ("population_compact", self.population_csv, file_fingerprint(self.population_csv))
+        population = self.registry.get(key, lambda: pd.read_csv(self.population_csv, usecols=POPULATION_COLUMNS,
+                                                                 dtype=POPULATION_DTYPES))
+        count("population_rows", len(population))
+        return population
+
+    def iter_population_chunks(self, chunksize=POPULATION_CHUNK_ROWS, year=None):
+        """Read the population grid in chunks of the used columns only, with compact dtypes (``POPULATION_DTYPES``)."""
+        columns = POPULATION_COLUMNS + (["year"] if year is not None else [])
+        for chunk in pd.read_csv(self.population_csv, usecols=columns, dtype=POPULATION_DTYPES, chunksize=chunksize):
+            if year is not None:
+                chunk = chunk[chunk["year"] == year]
+            yield chunk
+
+    @traced("DataLoader.stream_population_pyramid")
+    def stream_population_pyramid(self, resolutions=DEFAULT_RESOLUTIONS, chunksize=POPULATION_CHUNK_ROWS, year=None):
+        """Build a ``HexPyramid`` from the population grid without loading the whole file.
+
+        Each chunk is H3-indexed at every resolution and its partial aggregates are spilled to
+        disk; the levels are then merged and persisted one at a time. Peak memory is one chunk
+        plus the largest level, which at fine resolutions (every grid cell its own hexagon) is
+        as large as the grid itself. With a ``cache_dir`` no level is kept in memory afterwards.
+        Pass ``year`` to keep a single census year.
+        """
+        key = f"{file_fingerprint(self.population_csv)}-{year if year is not None else 'all'}"
+        pyramid = HexPyramid(key, cache_dir=self.cache_dir, resolutions=resolutions)
+        if pyramid.is_built():
+            return pyramid
+
+        logger.info("🔹 Streaming population grid...")
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        rows_read = 0
+        with tempfile.TemporaryDirectory(dir=self.cache_dir) as spill_dir:
+            spilled = {resolution: [] for resolution in pyramid.resolutions}
+            for chunk in self.iter_population_chunks(chunksize, year=year):
+                if chunk.empty:
+                    continue
+                index = MultiResolutionIndex(chunk["Lat"].to_numpy(), chunk["Lon"].to_numpy(), pyramid.resolutions)
+                for resolution, paths in spilled.items():
+                    path = os.path.join(spill_dir, f"r{resolution}-{len(paths)}.parquet")
+                    aggregate_cells(chunk, index.cells(resolution), row_offset=rows_read).to_parquet(path)
+                    paths.append(path)
+                rows_read += len(chunk)
+
+            if not rows_read:
+                raise ValueError(f"No population rows found in {self.population_csv}")
+            for resolution, paths in spilled.items():
+                partial = merge_partials([pd.read_parquet(path) for path in paths])
+                pyramid.store_level(resolution, partial, keep=False)
+
+        logger.info(f"✅ Aggregated {rows_read} grid cells into {len(partial)} hexagons")
+        count("rows_in", rows_read)
+        count("hexagons", len(partial))
+        return pyramid
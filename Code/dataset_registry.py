@@ -0,0 +1,49 @@
+import threading
+import time
+
+import pandas as pd
+
+
+class DatasetRegistry:
+    """Process-wide store of parsed datasets so each source is only parsed once.
+
+    Datasets are keyed by a tuple that should include the source fingerprint, so
+    an edited file is parsed again. The returned objects are shared between all
+    callers (and Streamlit sessions): treat them as read-only and copy before
+    adding columns.
+    """
+
+    def __init__(self):
+        self._datasets = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, load_fn):
+        """Return the dataset stored under ``key``, calling ``load_fn`` on a miss."""
+        with self._lock:
+            stats = self._stats.setdefault(key, {"hits": 0, "misses": 0, "load_seconds": 0.0})
+            if key in self._datasets:
+                stats["hits"] += 1
+                return self._datasets[key]
+
+            start = time.perf_counter()
+            dataset = load_fn()
+            stats["misses"] += 1
+            stats["load_seconds"] += time.perf_counter() - start
+            self._datasets[key] = dataset
+            return dataset
+
+    def stats(self):
+        """Hit/miss counters per dataset key."""
+        with self._lock:
+            rows = [{"dataset": " | ".join(map(str, key)), **stats} for key, stats in self._stats.items()]
+        return pd.DataFrame(rows, columns=["dataset", "hits", "misses", "load_seconds"])
+
+    def clear(self):
+        with self._lock:
+            self._datasets.clear()
+            self._stats.clear()
+
+
+# Shared by every DataLoader / SpiderMapLayer in this process
+registry = DatasetRegistry()
@@ -0,0 +1,100 @@
+import h3
+import numpy as np
+import pandas as pd
+import shapely
+
+DEFAULT_RESOLUTIONS = (5, 6, 7, 8, 9)
+MAX_CACHED_BOUNDARIES = 500000
+
+_cell_to_parent = np.frompyfunc(h3.cell_to_parent, 2, 1)
+
+# cell -> (n, 2) array of (lng, lat) boundary vertices, shared by every caller in the process
+_boundary_cache = {}
+
+
+def _unique_coordinates(lat, lng):
+    # One hash pass over lat + i*lng: np.unique(axis=0) sorts rows, which cost as much as the
+    # indexing itself on the population grid, whose coordinates are all distinct
+    coords = np.asarray(lat, dtype=float) + 1j * np.asarray(lng, dtype=float)
+    inverse, unique = pd.factorize(coords)
+    return unique.real, unique.imag, inverse
+
+
+def _index(lat, lng, resolution):
+    # h3 calls hold the GIL, so threads add nothing; a loop over Python floats beats np.frompyfunc
+    return np.array([h3.latlng_to_cell(a, b, resolution) for a, b in zip(lat.tolist(), lng.tolist())], dtype=object)
+
+
+def latlng_to_cells(lat, lng, resolution):
+    """Index whole coordinate arrays into H3 cells.
+
+    Repeated coordinates are indexed once; returns an object array of cell ids aligned with the input.
+    """
+    if len(lat) == 0:
+        return np.array([], dtype=object)
+    unique_lat, unique_lng, inverse = _unique_coordinates(lat, lng)
+    return _index(unique_lat, unique_lng, resolution)[inverse]
+
+
+def cells_to_parents(cells, resolution):
+    """Parent cells at a coarser resolution, computed once per distinct cell."""
+    cells = np.asarray(cells, dtype=object)
+    if len(cells) == 0:
+        return cells
+    unique, inverse = np.unique(cells.astype(str), return_inverse=True)
+    parents = _cell_to_parent(unique.astype(object), np.full(len(unique), resolution))
+    return parents.astype(object)[inverse.reshape(-1)]
+
+
+class MultiResolutionIndex:
+    """H3 cells of one coordinate set at several resolutions.
+
+    Distinct coordinates are found once and indexed directly at each resolution on first
+    use. Coarser cells are not derived with ``cell_to_parent``: H3 cells do not nest
+    exactly, so a point's parent cell is not always the cell that contains it.
+    """
+
+    def __init__(self, lat, lng, resolutions=DEFAULT_RESOLUTIONS):
+        self.resolutions = tuple(sorted(resolutions))
+        self._lat, self._lng, self._inverse = _unique_coordinates(lat, lng)
+        self._cells = {}
+
+    def cells(self, resolution):
+        """Cell ids at ``resolution`` aligned with the original coordinates."""
+        if resolution not in self._cells:
+            self._cells[resolution] = _index(self._lat, self._lng, resolution)
+        return self._cells[resolution][self._inverse]
+
+
+def _cell_boundary(cell):
+    boundary = _boundary_cache.get(cell)
+    if boundary is None:
+        if len(_boundary_cache) >= MAX_CACHED_BOUNDARIES:
+            _boundary_cache.clear()
+        # h3 returns (lat, lng) pairs; shapely wants (x, y) = (lng, lat)
+        boundary = np.asarray(h3.cell_to_boundary(cell))[:, ::-1]
+        _boundary_cache[cell] = boundary
+    return boundary
+
+
+def cells_to_polygons(cells):
+    """Build hexagon polygons for an array of cells in bulk (boundaries are memoized per cell)."""
+    cells = np.asarray(cells, dtype=object)
+    polygons = np.empty(len(cells), dtype=object)
+    if len(cells) == 0:
+        return polygons
+
+    unique, inverse = np.unique(cells.astype(str), return_inverse=True)
+    boundaries = [_cell_boundary(cell) for cell in unique]
+    unique_polygons = np.empty(len(unique), dtype=object)
+
+    # Hexagons have 6 vertices; pentagons and cells crossing icosahedron edges differ,
+    # so build one ring array per vertex count
+    vertex_counts = np.array([len(boundary) for boundary in boundaries])
+    for count in np.unique(vertex_counts):
+        idx = np.flatnonzero(vertex_counts == count)
+        rings = np.stack([boundaries[i] for i in idx])
+        unique_polygons[idx] = shapely.polygons(rings)
+
+    polygons[:] = unique_polygons[inverse.reshape(-1)]
+    return polygons
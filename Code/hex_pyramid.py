@@ -0,0 +1,162 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from h3_index import DEFAULT_RESOLUTIONS, MultiResolutionIndex
+from instrumentation import count, get_logger, traced
+from pipeline_cache import write_atomic
+
+logger = get_logger("hex_pyramid")
+
+# Same aggregation the hexbin layer has always used for the population grid
+HEX_AGGREGATIONS = {
+    "population_every_1km2": "sum",
+    "state": "first", "parlimen": "first", "dun": "first",
+    "ethnicity_proportion_bumi": "mean", "ethnicity_proportion_chinese": "mean", "ethnicity_proportion_indian": "mean",
+    "age_proportion_0_14": "mean", "age_proportion_15_64": "mean", "age_proportion_18_above": "mean", "age_proportion_65_above": "mean",
+    "income_avg": "mean", "expenditure_avg": "mean"
+}
+SUM_COLUMNS = [col for col, how in HEX_AGGREGATIONS.items() if how == "sum"]
+MEAN_COLUMNS = [col for col, how in HEX_AGGREGATIONS.items() if how == "mean"]
+FIRST_COLUMNS = [col for col, how in HEX_AGGREGATIONS.items() if how == "first"]
+PYRAMID_VERSION = 2  # Bumped when the layout or semantics of persisted levels change
+
+
+def aggregate_cells(frame, cells, row_offset=0):
+    """Partial hex aggregates of grid rows: sums, (sum, count) pairs for means, first values with their row.
+
+    Partials of disjoint sets of rows (e.g. chunks of a larger file) can be merged without
+    losing the exact mean/first semantics of a single groupby.
+    ``row_offset`` is the position of ``frame``'s first row in the full dataset.
+    """
+    hex_ids = pd.Index(np.asarray(cells, dtype=object), name="hex")
+    rows = np.arange(row_offset, row_offset + len(frame), dtype=float)
+    grouped = {}
+
+    for col in SUM_COLUMNS:
+        values = frame[col].to_numpy()
+        # Accumulate float32 input (e.g. streamed chunks) in float64
+        grouped[col] = values.astype(np.float64) if values.dtype.kind == "f" else values
+    for col in MEAN_COLUMNS:
+        values = frame[col].to_numpy(dtype=float)
+        grouped[f"{col}__sum"] = values
+        grouped[f"{col}__count"] = (~np.isnan(values)).astype(np.int64)
+    for col in FIRST_COLUMNS:
+        values = frame[col]
+        grouped[col] = values.to_numpy()
+        grouped[f"{col}__row"] = np.where(values.notna().to_numpy(), rows, np.nan)
+
+    return _reduce(pd.DataFrame(grouped, index=hex_ids), hex_ids)
+
+
+def _reduce(partial, keys):
+    """Combine partial aggregates that share a hex id."""
+    keys = pd.Index(np.asarray(keys, dtype=object), name="hex")
+    partial = partial.set_axis(keys, axis=0)
+
+    additive = SUM_COLUMNS + [f"{col}__{part}" for col in MEAN_COLUMNS for part in ("sum", "count")]
+    reduced = partial[additive].groupby(level="hex").sum()
+
+    for col in FIRST_COLUMNS:
+        row_col = f"{col}__row"
+        # Rows without a value have no row number, so the earliest row always carries the first value
+        firsts = partial[[col, row_col]].sort_values(row_col, kind="stable").groupby(level="hex").first()
+        reduced[col] = firsts[col]
+        reduced[row_col] = firsts[row_col]
+
+    return reduced
+
+
+def merge_partials(partials):
+    """Merge partial aggregates computed over disjoint sets of grid rows."""
+    combined = pd.concat(partials)
+    return _reduce(combined, combined.index.to_numpy())
+
+
+def finalize(partial):
+    """Turn partial aggregates into the hex table produced by ``groupby("hex").agg(HEX_AGGREGATIONS)``."""
+    hex_population = pd.DataFrame(index=partial.index.rename("hex"))
+    for col, how in HEX_AGGREGATIONS.items():
+        if how == "mean":
+            count = partial[f"{col}__count"]
+            hex_population[col] = (partial[f"{col}__sum"] / count).where(count > 0)
+        else:
+            hex_population[col] = partial[col]
+    return hex_population.sort_index().reset_index()
+
+
+class HexPyramid:
+    """Precomputed population hex aggregates at several H3 resolutions.
+
+    Every level is aggregated from the grid points indexed directly at its resolution
+    (H3 cells do not nest exactly, so rolling children up to their parents would count
+    points in hexes that do not contain them). Levels are persisted under ``cache_dir``
+    (keyed by the dataset fingerprint) and loaded lazily per resolution.
+    """
+
+    def __init__(self, key, cache_dir=None, resolutions=DEFAULT_RESOLUTIONS):
+        self.key = key
+        self.cache_dir = cache_dir
+        self.resolutions = tuple(sorted(resolutions))
+        self._partials = {}
+        self._levels = {}
+
+    def _path(self, resolution):
+        return os.path.join(self.cache_dir, f"hex_pyramid-v{PYRAMID_VERSION}-{self.key}", f"r{resolution}.parquet")
+
+    def is_built(self):
+        return all(res in self._partials or (bool(self.cache_dir) and os.path.exists(self._path(res)))
+                   for res in self.resolutions)
+
+    @traced("HexPyramid.build")
+    def build(self, gdf_population):
+        """Aggregate the population grid at every resolution."""
+        logger.info("🔹 Building hex aggregate pyramid...")
+        count("rows_in", len(gdf_population))
+        index = MultiResolutionIndex(gdf_population.geometry.y.to_numpy(), gdf_population.geometry.x.to_numpy(),
+                                     resolutions=self.resolutions)
+        return self.build_from_partials({resolution: aggregate_cells(gdf_population, index.cells(resolution))
+                                         for resolution in self.resolutions})
+
+    def build_from_partials(self, partials):
+        """Build the levels from partial aggregates (``aggregate_cells``) per resolution."""
+        missing = [resolution for resolution in self.resolutions if resolution not in partials]
+        if missing:
+            raise ValueError(f"No partial aggregates for resolutions {missing}")
+        self._partials = {}
+        self._levels = {}
+        for resolution in self.resolutions:
+            self.store_level(resolution, partials[resolution])
+        logger.info(f"✅ Hex pyramid built for resolutions {list(self.resolutions)}")
+        return self
+
+    def store_level(self, resolution, partial, keep=True):
+        """Set the partial aggregates of one level, persisting them under ``cache_dir``.
+
+        With ``keep=False`` and a ``cache_dir`` the level is not held in memory; ``level()``
+        reads it back lazily.
+        """
+        if resolution not in self.resolutions:
+            raise ValueError(f"Resolution {resolution} is not in the pyramid {list(self.resolutions)}")
+        self._levels.pop(resolution, None)
+        if self.cache_dir:
+            os.makedirs(os.path.dirname(self._path(resolution)), exist_ok=True)
+            # Atomic per level: another process's is_built() only passes once every level is complete
+            write_atomic(self._path(resolution), partial.to_parquet)
+        if keep or not self.cache_dir:
+            self._partials[resolution] = partial
+        else:
+            self._partials.pop(resolution, None)
+
+    def level(self, resolution):
+        """Hex table at ``resolution`` (a fresh copy, safe to modify)."""
+        if resolution not in self.resolutions:
+            raise ValueError(f"Resolution {resolution} is not in the pyramid {list(self.resolutions)}")
+        if resolution not in self._levels:
+            if resolution not in self._partials:
+                if not self.is_built():
+                    raise ValueError("Hex pyramid has not been built. Call build() first.")
+                self._partials[resolution] = pd.read_parquet(self._path(resolution))
+            self._levels[resolution] = finalize(self._partials[resolution])
+        return self._levels[resolution].copy()
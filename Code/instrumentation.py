@@ -0,0 +1,153 @@
+import contextvars
+import functools
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import pandas as pd
+
+LOG_LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR"]
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+MAX_SPANS = 10000
+
+# Parent of every module logger ("pinpoint.data_loader", ...), so one level setting covers them all
+logger = logging.getLogger("pinpoint")
+
+
+def get_logger(name):
+    return logger.getChild(name)
+
+
+def set_log_level(level):
+    """Set the level of the ``pinpoint`` loggers (a name such as ``"DEBUG"`` or a ``logging`` constant)."""
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+
+
+def configure_logging(level=None):
+    """Log to stderr at ``level`` (default: ``PINPOINT_LOG_LEVEL``, else INFO).
+
+    For entry points only, called once at startup: importing the modules leaves handlers and
+    levels to the host application, and records propagate to its root handlers.
+    """
+    logging.basicConfig(format=LOG_FORMAT)  # No-op when the host already configured logging
+    set_log_level(level or os.environ.get("PINPOINT_LOG_LEVEL", "INFO"))
+
+
+class Span:
+    """One timed section, with optional attributes and counters (rows in/out, clusters, ...)."""
+
+    def __init__(self, span_id, name, parent, attributes):
+        self.id = span_id
+        self.name = name
+        self.parent_id = parent.id if parent is not None else None
+        self.trace_id = parent.trace_id if parent is not None else span_id
+        self.depth = parent.depth + 1 if parent is not None else 0
+        self.attributes = dict(attributes)
+        self.counters = {}
+        self.thread_id = threading.get_ident()
+        self.start = None
+        self.seconds = None
+
+    def count(self, name, value=1):
+        value = value.item() if hasattr(value, "item") else value  # NumPy scalars, so traces stay JSON-serializable
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class Tracer:
+    """Collects nested timing spans.
+
+    Spans opened inside another span (in the same thread or Streamlit session) become its
+    children and share its trace id, so the breakdown of one rerun can be read back with
+    ``report(root_span)`` even when several sessions are traced at once. Only the most
+    recent ``max_spans`` spans are kept.
+    """
+
+    def __init__(self, max_spans=MAX_SPANS):
+        self.spans = deque(maxlen=max_spans)
+        self._ids = itertools.count(1)
+        self._current = contextvars.ContextVar("pinpoint_span", default=None)
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **attributes):
+        span = Span(next(self._ids), name, self._current.get(), attributes)
+        token = self._current.set(span)
+        span.start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span.seconds = time.perf_counter() - span.start
+            self._current.reset(token)
+            with self._lock:
+                self.spans.append(span)
+            logger.debug("%s took %.3f s %s", name, span.seconds, span.counters or "")
+
+    def traced(self, name=None):
+        """Decorator running the function inside a span (named after the function by default)."""
+        def decorate(func):
+            span_name = name or func.__qualname__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def count(self, name, value=1):
+        """Add to a counter of the innermost open span (no-op outside any span)."""
+        span = self._current.get()
+        if span is not None:
+            span.count(name, value)
+
+    def _spans(self, trace=None):
+        with self._lock:
+            spans = list(self.spans)
+        if trace is not None:
+            spans = [span for span in spans if span.trace_id == trace.trace_id]
+        return sorted(spans, key=lambda span: span.start)
+
+    def report(self, trace=None):
+        """Finished spans (of the trace of span ``trace`` if given) in start order, one column per counter."""
+        rows = [{"span": "  " * span.depth + span.name, "start_s": span.start - self._origin, "seconds": span.seconds,
+                 **span.attributes, **span.counters} for span in self._spans(trace)]
+        return pd.DataFrame(rows, columns=None if rows else ["span", "start_s", "seconds"])
+
+    def chrome_trace(self, trace=None):
+        """Spans in the Chrome trace event format (open in chrome://tracing or ui.perfetto.dev)."""
+        pid = os.getpid()
+        events = [{
+            "name": span.name,
+            "cat": "pinpoint",
+            "ph": "X",
+            "ts": (span.start - self._origin) * 1e6,
+            "dur": span.seconds * 1e6,
+            "pid": pid,
+            "tid": span.thread_id,
+            "args": {**span.attributes, **span.counters}
+        } for span in self._spans(trace)]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path, trace=None):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(trace), f, default=str)
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+
+
+# Shared by every module in this process
+tracer = Tracer()
+span = tracer.span
+traced = tracer.traced
+count = tracer.count
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+import shapely
+
+from instrumentation import count, get_logger, traced
+
+logger = get_logger("map_export")
+
+# Columns shown in the Kepler.gl tooltips/legends per layer; everything else stays server-side
+DISPLAY_COLUMNS = {
+    "Hexbins": ["hex", "population_every_1km2", "state", "parlimen", "dun", "income_avg", "expenditure_avg",
+                "color", "type"],
+    "POIs": ["Brand", "Name", "POI_state", "Tier", "cluster"],
+    "Clusters": ["Cluster_ID", "Total_POI", "Parlimen", "Dun"],
+    "LRT Links": ["hub_id", "station_name", "distance_km"],
+    "LRT Stations": ["station_name", "type"]
+}
+DEFAULT_PRECISION = 5  # Decimal places of lon/lat, ~1 m
+
+
+def payload_bytes(dataset):
+    """Approximate size of a dataset once serialized for the browser."""
+    return len(dataset.to_csv(index=False).encode())
+
+
+def display_layer(name, gdf, display_columns=DISPLAY_COLUMNS):
+    """The layer reduced to its displayed columns (plus geometry), e.g. to persist it for later compaction."""
+    columns = [col for col in display_columns.get(name, gdf.columns) if col in gdf.columns and col != "geometry"]
+    if "geometry" in gdf.columns:
+        columns.append("geometry")
+    return gdf[columns]
+
+
+def compact_layer(name, gdf, precision=DEFAULT_PRECISION, h3_hexes=False, display_columns=DISPLAY_COLUMNS):
+    """Browser-ready table for one layer.
+
+    Only displayed columns are kept, points become rounded Latitude/Longitude columns,
+    other geometries become WKT at ``precision`` decimals, and with ``h3_hexes`` the
+    hexbins are sent as H3 ids (``hex_id``) for Kepler's native H3 layer instead of polygons.
+    """
+    columns = [col for col in display_columns.get(name, gdf.columns) if col in gdf.columns and col != "geometry"]
+    table = pd.DataFrame(gdf[columns]).copy()
+
+    if "hex" in table.columns:
+        if h3_hexes:
+            return table.rename(columns={"hex": "hex_id"})
+        table = table.drop(columns="hex")  # Otherwise Kepler would draw an H3 layer on top of the polygons
+
+    if "geometry" in gdf.columns:
+        geometries = np.asarray(gdf.geometry, dtype=object)
+        if len(geometries) and (shapely.get_type_id(geometries) == 0).all():
+            table["Latitude"] = np.round(shapely.get_y(geometries), precision)
+            table["Longitude"] = np.round(shapely.get_x(geometries), precision)
+        else:
+            table["geometry"] = shapely.to_wkt(geometries, rounding_precision=precision, trim=True)
+    for col in table.select_dtypes(include=[np.floating]).columns:
+        if col not in ("Latitude", "Longitude"):
+            table[col] = table[col].round(3)
+    return table
+
+
+@traced("build_map_payload")
+def build_map_payload(layers, budget_bytes=None, precision=DEFAULT_PRECISION, h3_hexes=False):
+    """Compact, de-duplicated datasets for Kepler.gl and a per-layer payload report.
+
+    When the total exceeds ``budget_bytes`` the payload is reduced step by step: hexbins
+    are sent as H3 ids, coordinates are rounded one decimal further, and finally the
+    lowest-priority layers (last in ``layers``) are dropped. The first layer is always kept.
+    """
+    unique_layers = {}
+    seen = set()
+    for name, layer in layers.items():
+        if id(layer) not in seen:  # The same frame registered twice is only sent once
+            seen.add(id(layer))
+            unique_layers[name] = layer
+
+    def compact(precision, h3_hexes):
+        return {name: compact_layer(name, layer, precision, h3_hexes) for name, layer in unique_layers.items()}
+
+    datasets = compact(precision, h3_hexes)
+    sizes = {name: payload_bytes(dataset) for name, dataset in datasets.items()}
+    steps = []
+
+    if budget_bytes is not None:
+        for step, (step_precision, step_h3) in [("hexbins as H3 ids", (precision, True)),
+                                                 ("coarser coordinates", (precision - 1, True))]:
+            if sum(sizes.values()) <= budget_bytes or (step_h3 == h3_hexes and step_precision == precision):
+                continue
+            datasets = compact(step_precision, step_h3)
+            sizes = {name: payload_bytes(dataset) for name, dataset in datasets.items()}
+            steps.append(step)
+
+        for name in list(datasets)[:0:-1]:
+            if sum(sizes[sent] for sent in datasets) <= budget_bytes:
+                break
+            del datasets[name]
+            steps.append(f"dropped {name}")
+            logger.warning(f"⚠️ Map payload over budget, dropping layer '{name}'")
+
+    report = pd.DataFrame({
+        "layer": list(unique_layers),
+        "rows": [len(layer) for layer in unique_layers.values()],
+        "columns": [len(datasets[name].columns) if name in datasets else None for name in unique_layers],
+        "bytes": [sizes[name] for name in unique_layers],
+        "sent": [name in datasets for name in unique_layers]
+    })
+    report.attrs["steps"] = steps
+    count("layers_sent", len(datasets))
+    count("bytes_sent", sum(sizes[name] for name in datasets))
+    return datasets, report
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import threading
+
+import joblib
+import numpy as np
+from sklearn.ensemble import HistGradientBoostingClassifier, RandomForestClassifier
+
+from instrumentation import count, get_logger, traced
+from pipeline_cache import write_atomic
+from process_pool import spawn_pool
+
+logger = get_logger("model_registry")
+
+DEFAULT_HYPERPARAMETERS = {"n_estimators": 200, "random_state": 42}
+HGB_HYPERPARAMETERS = {"max_iter": 100, "random_state": 42}
+SLIDER_PERCENTILES = list(range(30, 100, 5))  # Values of the population percentile slider
+
+
+def population_threshold(X_train, percentile):
+    """Population threshold of a percentile setting (the label cut of the suitability model)."""
+    return np.percentile(X_train["population_every_1km2"], percentile)
+
+
+def fit_suitability_model(X_train, threshold, hyperparameters=DEFAULT_HYPERPARAMETERS, n_jobs=-1):
+    """Fit the RandomForest suitability model (label: population above ``threshold``)."""
+    y_train = (X_train["population_every_1km2"] > threshold).astype(int)
+    model = RandomForestClassifier(n_jobs=n_jobs, **hyperparameters)
+    model.fit(X_train, y_train)
+    return model
+
+
+def fit_hist_gradient_boosting_model(X_train, threshold, hyperparameters=HGB_HYPERPARAMETERS, n_jobs=None):
+    """Fit the histogram gradient boosting suitability model (``n_jobs`` is unused: it threads via OpenMP)."""
+    y_train = (X_train["population_every_1km2"] > threshold).astype(int)
+    return HistGradientBoostingClassifier(**hyperparameters).fit(X_train, y_train)
+
+
+# Model kind -> fit function, as accepted by ModelRegistry.get / pretrain
+MODEL_FITTERS = {
+    "random_forest": fit_suitability_model,
+    "hist_gradient_boosting": fit_hist_gradient_boosting_model
+}
+
+
+def _dump_atomic(model, path):
+    write_atomic(path, lambda tmp_path: joblib.dump(model, tmp_path))
+
+
+def _train_and_save(X_train, percentile, kind, hyperparameters, path):
+    # Runs in a pool worker: one core per model, the pool provides the parallelism
+    model = MODEL_FITTERS[kind](X_train, population_threshold(X_train, percentile), hyperparameters, n_jobs=1)
+    if "n_jobs" in model.get_params():
+        model.set_params(n_jobs=-1)
+    _dump_atomic(model, path)
+    return path
+
+
+class ModelRegistry:
+    """On-disk store of trained suitability models.
+
+    Models are keyed by (model kind, dataset fingerprint, feature list, percentile setting,
+    hyperparameters), persisted with joblib and loaded lazily with memory mapping. ``pretrain`` fits all
+    slider percentiles in a background process pool so slider moves hit a ready model.
+    ``n_jobs`` is the thread count of the models handed out (use 1 inside worker processes).
+    """
+
+    def __init__(self, cache_dir, hyperparameters=DEFAULT_HYPERPARAMETERS, max_workers=None,
+                 hgb_hyperparameters=HGB_HYPERPARAMETERS, n_jobs=-1):
+        self.cache_dir = os.path.join(cache_dir, "models")
+        self.hyperparameters = {"random_forest": dict(hyperparameters),
+                                "hist_gradient_boosting": dict(hgb_hyperparameters)}
+        self.max_workers = max_workers
+        self.n_jobs = n_jobs
+        self._models = {}
+        self._pending = {}
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def key(self, dataset_fingerprint, feature_columns, percentile, kind="random_forest"):
+        if kind not in MODEL_FITTERS:
+            raise ValueError(f"Unknown model kind '{kind}', expected one of {list(MODEL_FITTERS)}")
+        payload = json.dumps({
+            "model": kind,
+            "dataset": dataset_fingerprint,
+            "features": list(feature_columns),
+            "percentile": percentile,
+            "hyperparameters": self.hyperparameters[kind]
+        }, sort_keys=True)
+        return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+    def _path(self, key, kind):
+        return os.path.join(self.cache_dir, f"{kind}-{key}.joblib")
+
+    @traced("ModelRegistry.get")
+    def get(self, dataset_fingerprint, X_train, percentile, kind="random_forest"):
+        """Return the ``kind`` model for this dataset and percentile, training (and persisting) it only if needed."""
+        key = self.key(dataset_fingerprint, X_train.columns, percentile, kind)
+        with self._lock:
+            if key in self._models:
+                count("memory_hits")
+                return self._models[key]
+            pending = self._pending.pop(key, None)
+
+        if pending is not None:
+            count("waited_for_pretraining")
+            try:
+                pending.result()  # Being pretrained in the background: wait rather than fit twice
+            except Exception as e:
+                logger.warning(f"⚠️ Background training for percentile {percentile} failed ({e!r}); fitting here")
+
+        path = self._path(key, kind)
+        if os.path.exists(path):
+            model = joblib.load(path, mmap_mode="r")
+            count("disk_hits")
+        else:
+            threshold = population_threshold(X_train, percentile)
+            logger.info(f"🔹 Training {kind} suitability model (percentile {percentile}, threshold {threshold:.1f})...")
+            count("trained")
+            model = MODEL_FITTERS[kind](X_train, threshold, self.hyperparameters[kind], n_jobs=self.n_jobs)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            _dump_atomic(model, path)
+        if "n_jobs" in model.get_params():
+            model.set_params(n_jobs=self.n_jobs)  # Persisted models use every core
+
+        with self._lock:
+            self._models[key] = model
+        return model
+
+    def pretrain(self, dataset_fingerprint, X_train, percentiles, kind="random_forest"):
+        """Fit every missing ``kind`` model for ``percentiles`` in a background process pool (returns immediately)."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self._lock:
+            for percentile in percentiles:
+                key = self.key(dataset_fingerprint, X_train.columns, percentile, kind)
+                path = self._path(key, kind)
+                if key in self._models or key in self._pending or os.path.exists(path):
+                    continue
+                if self._pool is None:
+                    self._pool = spawn_pool(self.max_workers)
+                self._pending[key] = self._pool.submit(
+                    _train_and_save, X_train, percentile, kind, self.hyperparameters[kind], path
+                )
+        return list(self._pending.values())
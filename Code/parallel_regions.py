@@ -0,0 +1,234 @@
+"""Region-partitioned, multi-process execution of the clustering, hexbin and spider stages.
+
+Points are partitioned by the coarse H3 cell they fall in. A partition also receives
+the points of neighbouring cells within a halo around it, so every neighbourhood
+that crosses a partition border is complete inside the partition that owns it.
+Partitions run in a shared process pool and the results are merged:
+
+- DBSCAN clusters are stitched across partitions through points that are core points
+  in their home partition, and renumbered into globally unique cluster ids.
+- Hexagons are scored per coarse parent cell, so no hexagon is split.
+- Spider links are computed per partition of hubs against the stations in its halo.
+"""
+import os
+import threading
+from functools import partial
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from h3_index import cells_to_parents, latlng_to_cells
+from instrumentation import count, traced
+from process_pool import spawn_pool
+from streamlitDBSCAN import EARTH_RADIUS_M, POIClustering
+from streamlitHexbin import HexbinGenerator, fill_hex_features
+from streamlitSpider import radius_join, sort_links
+
+PARTITION_RESOLUTION = 4  # H3 cells of ~1,800 km²: a few per state, a few hundred nationwide
+# The halo is sampled at 8 compass points, so it is made wider than the search radius to
+# cover border points whose nearest partition edge lies between two sampled directions
+HALO_FACTOR = 2
+
+# max_workers -> ProcessPoolExecutor, reused across Streamlit reruns
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _pool(max_workers):
+    with _pools_lock:
+        if max_workers not in _pools:
+            _pools[max_workers] = spawn_pool(max_workers)
+        return _pools[max_workers]
+
+
+def _run_batch(func, tasks):
+    return [func(*task) for task in tasks]
+
+
+def map_partitions(func, tasks, max_workers=None):
+    """``[func(*task) for task in tasks]``, spread over the process pool in one batch per worker."""
+    workers = max_workers or os.cpu_count() or 1
+    if workers == 1 or len(tasks) <= 1:
+        return [func(*task) for task in tasks]
+
+    # Round-robin batches: shared arguments (e.g. a fitted model) are pickled once per batch, not per task
+    n_batches = min(workers, len(tasks))
+    batches = [tasks[start::n_batches] for start in range(n_batches)]
+    results = [None] * len(tasks)
+    for start, batch_results in enumerate(_pool(workers).map(partial(_run_batch, func), batches)):
+        results[start::n_batches] = batch_results
+    return results
+
+
+def _group_indices(keys):
+    """Positions of each distinct key (an object array of cells), sorted by key."""
+    return dict(sorted(pd.DataFrame({"key": keys}).groupby("key").indices.items()))
+
+
+def halo_members(lat, lon, home_cells, halo_meters, resolution=PARTITION_RESOLUTION):
+    """Point positions per partition cell: the points in the cell plus those within ``halo_meters`` of it."""
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    points = [np.arange(len(lat))]
+    cells = [home_cells]
+    if halo_meters > 0 and len(lat):
+        dlat = np.degrees(halo_meters / EARTH_RADIUS_M)
+        dlon = dlat / np.cos(np.radians(lat))
+        for angle in np.arange(8) * np.pi / 4:
+            offset_cells = latlng_to_cells(lat + dlat * np.sin(angle), lon + dlon * np.cos(angle), resolution)
+            in_halo = offset_cells != home_cells
+            points.append(np.flatnonzero(in_halo))
+            cells.append(offset_cells[in_halo])
+
+    pairs = pd.DataFrame({"cell": np.concatenate(cells), "point": np.concatenate(points)}).drop_duplicates()
+    return {cell: np.sort(group.to_numpy()) for cell, group in pairs.groupby("cell")["point"]}
+
+
+def stitch_clusters(n_points, partition_points, partition_home, partition_labels, partition_core):
+    """Global DBSCAN labels from per-partition runs over overlapping point sets.
+
+    Every partition contributes its points' positions, which of them it owns (home),
+    their local labels and their core flags. Only home points have a complete
+    neighbourhood, so only their core flags are trusted: a point that is core at home
+    joins every local cluster it belongs to in any partition. Returns consecutive
+    global cluster ids (-1 for noise).
+    """
+    points = np.concatenate(partition_points)
+    is_home = np.concatenate(partition_home)
+    labels = np.concatenate(partition_labels)
+    core = np.concatenate(partition_core)
+
+    # One graph node per (partition, local cluster)
+    n_local = [int(part.max()) + 1 if len(part) else 0 for part in partition_labels]
+    offsets = np.repeat(np.concatenate([[0], np.cumsum(n_local)[:-1]]), [len(part) for part in partition_labels])
+    node = np.where(labels >= 0, labels + offsets, -1)
+    n_nodes = int(sum(n_local))
+    if n_nodes == 0:
+        return np.full(n_points, -1, dtype=np.int64)
+
+    core_point = np.zeros(n_points, dtype=bool)
+    core_point[points[is_home]] = core[is_home]
+    home_node = np.full(n_points, -1, dtype=np.int64)
+    home_node[points[is_home]] = node[is_home]
+
+    link = (node >= 0) & ~is_home & core_point[points]
+    graph = coo_matrix((np.ones(link.sum()), (node[link], home_node[points[link]])), shape=(n_nodes, n_nodes))
+    _, component = connected_components(graph, directed=False)
+
+    # Points left as noise at home can still be border points of a cluster owned by a neighbour
+    point_node = home_node.copy()
+    borrowed = (node >= 0) & ~is_home & (home_node[points] < 0)
+    point_node[points[borrowed]] = node[borrowed]
+
+    global_labels = np.full(n_points, -1, dtype=np.int64)
+    clustered = point_node >= 0
+    global_labels[clustered] = np.unique(component[point_node[clustered]], return_inverse=True)[1].reshape(-1)
+    return global_labels
+
+
+def _cluster_partition(lat, lon, eps_meters, min_samples, max_eps_meters):
+    gdf_part = gpd.GeoDataFrame(geometry=gpd.points_from_xy(lon, lat), crs="EPSG:4326")
+    clustering = POIClustering(eps_meters=eps_meters, min_samples=min_samples, max_eps_meters=max_eps_meters,
+                               output_csv=None)
+    labels = clustering.cluster_pois(gdf_part)["cluster"].to_numpy()
+    return labels, clustering.core_mask
+
+
+@traced("parallel_regions.cluster_pois")
+def cluster_pois_partitioned(gdf_poi, eps_meters=100, min_samples=3, max_eps_meters=500,
+                             resolution=PARTITION_RESOLUTION, max_workers=None):
+    """``POIClustering.cluster_pois`` per region partition in the process pool, with global cluster ids.
+
+    Core points and their clusters match a single DBSCAN run over all POIs; as in DBSCAN
+    itself, a border point reachable from two clusters may end up in either.
+    """
+    if gdf_poi.empty:
+        return POIClustering(eps_meters=eps_meters, min_samples=min_samples, output_csv=None).cluster_pois(gdf_poi)
+
+    lat = gdf_poi.geometry.y.to_numpy()
+    lon = gdf_poi.geometry.x.to_numpy()
+    home = latlng_to_cells(lat, lon, resolution)
+    members = halo_members(lat, lon, home, HALO_FACTOR * eps_meters, resolution)
+    cells = list(_group_indices(home))
+
+    tasks = [(lat[members[cell]], lon[members[cell]], eps_meters, min_samples, max(max_eps_meters, eps_meters))
+             for cell in cells]
+    results = map_partitions(_cluster_partition, tasks, max_workers)
+
+    gdf_poi["cluster"] = stitch_clusters(
+        len(gdf_poi),
+        [members[cell] for cell in cells],
+        [home[members[cell]] == cell for cell in cells],
+        [labels for labels, _ in results],
+        [core for _, core in results]
+    )
+    count("partitions", len(cells))
+    count("clusters", len(set(gdf_poi["cluster"]) - {-1}))
+    return gdf_poi
+
+
+def _partition_key(hex_ids, hex_resolution, resolution):
+    return cells_to_parents(hex_ids, min(resolution, hex_resolution))
+
+
+def _predict_partition(scorer, hex_resolution, hex_part):
+    return HexbinGenerator(None, scorer, hex_resolution=hex_resolution).predict_hexbins(hex_part)
+
+
+@traced("parallel_regions.predict_hexbins")
+def predict_hexbins_partitioned(hex_population, scorer, hex_resolution=7, resolution=PARTITION_RESOLUTION,
+                                max_workers=None):
+    """``HexbinGenerator.predict_hexbins`` split by coarse parent cell.
+
+    Feature gaps are filled with the medians of the whole table first, so every partition
+    scores exactly as the single-process version would.
+    """
+    if hex_population is None or hex_population.empty:
+        return None
+
+    hex_population = fill_hex_features(hex_population)
+    parts = _group_indices(_partition_key(hex_population["hex"].to_numpy(), hex_resolution, resolution))
+    tasks = [(scorer, hex_resolution, hex_population.iloc[idx]) for idx in parts.values()]
+    results = [gdf for gdf in map_partitions(_predict_partition, tasks, max_workers) if gdf is not None]
+    count("partitions", len(parts))
+    if not results:
+        return None
+    return gpd.GeoDataFrame(pd.concat(results, ignore_index=True), geometry="geometry", crs="EPSG:4326")
+
+
+@traced("parallel_regions.radius_join")
+def partitioned_radius_join(hub_lat, hub_lon, station_lat, station_lon, max_distance_km, nearest_k=None,
+                            resolution=PARTITION_RESOLUTION, max_workers=None):
+    """``radius_join`` per partition of hubs against the stations in its halo (same result and order).
+
+    Pass it to ``SpiderMapLayer.generate_spider_outputs(join=...)``.
+    """
+    hub_lat = np.asarray(hub_lat, dtype=float)
+    hub_lon = np.asarray(hub_lon, dtype=float)
+    station_lat = np.asarray(station_lat, dtype=float)
+    station_lon = np.asarray(station_lon, dtype=float)
+    if len(hub_lat) == 0 or len(station_lat) == 0:
+        return radius_join(hub_lat, hub_lon, station_lat, station_lon, max_distance_km, nearest_k)
+
+    hub_parts = _group_indices(latlng_to_cells(hub_lat, hub_lon, resolution))
+    station_parts = halo_members(station_lat, station_lon, latlng_to_cells(station_lat, station_lon, resolution),
+                                 HALO_FACTOR * max_distance_km * 1000, resolution)
+    no_stations = np.array([], dtype=np.int64)
+
+    cells = list(hub_parts)
+    stations = [station_parts.get(cell, no_stations) for cell in cells]
+    tasks = [(hub_lat[hub_parts[cell]], hub_lon[hub_parts[cell]], station_lat[station_idx], station_lon[station_idx],
+              max_distance_km, nearest_k) for cell, station_idx in zip(cells, stations)]
+    results = map_partitions(radius_join, tasks, max_workers)
+    count("partitions", len(cells))
+
+    hub_idx = np.concatenate([hub_parts[cell][part_hubs] for cell, (part_hubs, _, _) in zip(cells, results)])
+    station_idx = np.concatenate([station_idx[part_stations]
+                                  for station_idx, (_, part_stations, _) in zip(stations, results)])
+    distance_km = np.concatenate([distances for _, _, distances in results])
+
+    # Hub order, closest station first, ties by station index, as radius_join returns
+    return sort_links(hub_idx, station_idx, distance_km)
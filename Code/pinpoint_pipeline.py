@@ -0,0 +1,253 @@
+from functools import partial
+
+import pandas as pd
+
+from data_loader import file_fingerprint
+from h3_index import latlng_to_cells
+from hex_pyramid import HexPyramid
+from model_registry import SLIDER_PERCENTILES, fit_suitability_model, population_threshold
+from parallel_regions import cluster_pois_partitioned, partitioned_radius_join, predict_hexbins_partitioned
+from pipeline import Pipeline
+from pipeline_cache import fingerprint
+from poi_layer import POIProcessor
+from region_index import RegionIndex
+from streamlitDBSCAN import POIClustering
+from streamlitHexbin import (FEATURE_COLUMNS, HexbinGenerator, HistGradientBoostingScorer, RandomForestScorer,
+                             ThresholdScorer, benchmark_scorers)
+from streamlitSpider import SpiderMapLayer
+
+MAX_EPS_METERS = 500  # Largest value of the clustering radius slider
+SCORERS = ["threshold", "hist_gradient_boosting", "random_forest"]
+
+
+def training_data(gdf_population, percentiles):
+    """Model features of the population grid and the population threshold for each percentile."""
+    X_train = gdf_population[FEATURE_COLUMNS].fillna(gdf_population[FEATURE_COLUMNS].median())
+    return X_train, population_threshold(X_train, percentiles)
+
+
+def pretrain_models(loader, model_registry, percentiles=SLIDER_PERCENTILES, stream_population=False):
+    """Start fitting the models for every slider percentile in the background."""
+    X_train, _ = training_data(_population(loader, stream_population), percentiles)
+    return model_registry.pretrain(file_fingerprint(loader.population_csv), X_train, percentiles)
+
+
+def _population(loader, stream_population):
+    """Population grid: the compact read when streaming (the full grid is never loaded), else the loaded grid."""
+    if stream_population:
+        return loader.read_population()
+    _, gdf_population, _ = loader.load_data()
+    return gdf_population
+
+
+def _load(loader, include_population, dataset_fingerprint):
+    return loader.load_data(include_population=include_population)
+
+
+def _read_population(loader, dataset_fingerprint):
+    return loader.read_population()
+
+
+def _loaded_population(datasets):
+    _, gdf_population, _ = datasets
+    return gdf_population
+
+
+def _state_index(datasets, population):
+    # POIs and population cells are tagged with their state once; selections are then plain masks
+    gdf_poi, _, gdf_states = datasets
+    region_index = RegionIndex(gdf_states)
+    population_states = region_index.state_of(population["Lon"].to_numpy(), population["Lat"].to_numpy())
+    return region_index, region_index.tag_states(gdf_poi), population_states
+
+
+def _state_filter(datasets, state_index, target_states):
+    _, _, gdf_states = datasets
+    region_index, tagged_poi, _ = state_index
+    gdf_selected_states = gdf_states[gdf_states["state"].isin(target_states)]
+    return POIProcessor().filter_pois(tagged_poi, gdf_selected_states, region_index=region_index)
+
+
+def _poi_h3(filtered_poi):
+    return POIProcessor().assign_poi_to_hex(filtered_poi.copy())
+
+
+def _hex_pyramid(loader, cache_dir, datasets):
+    _, gdf_population, _ = datasets
+    pyramid = HexPyramid(file_fingerprint(loader.population_csv), cache_dir=cache_dir)
+    if not pyramid.is_built():
+        pyramid.build(gdf_population)
+    return pyramid
+
+
+def _streamed_hex_pyramid(loader, dataset_fingerprint):
+    return loader.stream_population_pyramid()
+
+
+def _hex_aggregation(loader, pyramid, hex_resolution):
+    return HexbinGenerator(loader, None, hex_resolution=hex_resolution).aggregate_population(pyramid=pyramid)
+
+
+def _hex_state_filter(population, state_index, hex_table, hex_resolution, target_states):
+    """Hexagons holding population cells of the selected states."""
+    _, _, population_states = state_index
+    selected = pd.Series(population_states).isin(list(target_states)).to_numpy()  # None outside every state
+    hexes = latlng_to_cells(population["Lat"].to_numpy()[selected], population["Lon"].to_numpy()[selected],
+                            hex_resolution)
+    return hex_table[hex_table["hex"].isin(hexes)].reset_index(drop=True)
+
+
+def build_scorer(loader, gdf_population, percentile, scorer="threshold", model_registry=None):
+    """Suitability scorer for a percentile: the pure population cut, or a model trained to approximate it."""
+    X_train, threshold = training_data(gdf_population, percentile)
+    if scorer == "threshold":
+        return ThresholdScorer(threshold)
+    if scorer == "hist_gradient_boosting":
+        if model_registry is None:
+            return HistGradientBoostingScorer().fit(X_train, threshold)
+        return HistGradientBoostingScorer(model_registry.get(file_fingerprint(loader.population_csv), X_train,
+                                                             percentile, kind="hist_gradient_boosting"))
+    if scorer == "random_forest":
+        if model_registry is None:
+            return RandomForestScorer(fit_suitability_model(X_train, threshold))
+        return RandomForestScorer(model_registry.get(file_fingerprint(loader.population_csv), X_train, percentile))
+    raise ValueError(f"Unknown scorer '{scorer}', expected one of {SCORERS}")
+
+
+def benchmark(loader, hex_table, gdf_population, percentile, model_registry=None):
+    """Compare every scorer on a hex table (agreement is measured against the threshold rule)."""
+    scorers = [build_scorer(loader, gdf_population, percentile, name, model_registry) for name in SCORERS]
+    return benchmark_scorers(scorers, hex_table)
+
+
+def _model_training(loader, model_registry, population, percentile, scorer):
+    return build_scorer(loader, population, percentile, scorer, model_registry)
+
+
+def _hex_prediction(loader, parallel_workers, hex_table, model, hex_resolution):
+    if parallel_workers:
+        gdf_hex = predict_hexbins_partitioned(hex_table, model, hex_resolution, max_workers=parallel_workers)
+    else:
+        gdf_hex = HexbinGenerator(loader, model).predict_hexbins(hex_table)
+    if gdf_hex is None:
+        return None
+
+    gdf_hex = gdf_hex.set_geometry("geometry")
+    if gdf_hex.crs is None:
+        gdf_hex.set_crs(epsg=4326, inplace=True)
+    else:
+        gdf_hex = gdf_hex.to_crs(epsg=4326)
+
+    gdf_hex["type"] = "Hexbin"
+    return gdf_hex
+
+
+def _coloring(loader, gdf_hex, color_group, color_buckets):
+    if gdf_hex is None:
+        return None
+    return HexbinGenerator(loader, None).assign_quantile_buckets(gdf_hex.copy(), group_col=color_group,
+                                                                 n_buckets=color_buckets)
+
+
+def _clustering(cluster_csv, parallel_workers, gdf_poi, population, eps_meters):
+    # The neighbor graph is cached at the slider maximum, so smaller radii only re-run DBSCAN
+    clustering = POIClustering(eps_meters=eps_meters, max_eps_meters=MAX_EPS_METERS, output_csv=cluster_csv,
+                               export_async=True)
+    if parallel_workers:
+        clustered_poi = cluster_pois_partitioned(gdf_poi.copy(), eps_meters, max_eps_meters=MAX_EPS_METERS,
+                                                 max_workers=parallel_workers)
+    else:
+        clustered_poi = clustering.cluster_pois(gdf_poi.copy())
+    cluster_polygons = clustering.generate_cluster_polygons(clustered_poi, population)
+    if cluster_polygons is not None and not cluster_polygons.empty:
+        cluster_polygons = cluster_polygons.set_geometry("geometry")
+        cluster_polygons.set_crs(epsg=4326, inplace=True)
+    return clustered_poi, cluster_polygons
+
+
+def _spider(lrt_file, parallel_workers, clusters, spider_km, lrt_fingerprint):
+    _, cluster_polygons = clusters
+    spider_layer = SpiderMapLayer(lrt_file, max_distance_km=spider_km, commercial_hubs=cluster_polygons)
+    spider_layer.load_data()
+    if parallel_workers:
+        return spider_layer.generate_spider_outputs(join=partial(partitioned_radius_join, max_workers=parallel_workers))
+    return spider_layer.generate_spider_outputs()
+
+
+def _map_layers(gdf_hex, clusters, spider):
+    """Named, non-empty map layers in display order."""
+    gdf_poi, cluster_polygons = clusters
+    spider_gdf, lrt_points_gdf = spider
+    layers = {
+        "Hexbins": gdf_hex,
+        "POIs": gdf_poi,
+        "Clusters": cluster_polygons,
+        "LRT Links": spider_gdf,
+        "LRT Stations": lrt_points_gdf
+    }
+    return {name: layer for name, layer in layers.items() if layer is not None and not layer.empty}
+
+
+def build_pinpoint_pipeline(loader, lrt_file, cache_dir=None, model_registry=None, cluster_csv="Clustered_POIs.csv",
+                            stream_population=False, parallel_workers=None):
+    """Stage graph behind the Streamlit app: load → filter/index → model/hexbins/clusters → spider → map.
+
+    ``target_states`` selects the POIs, clusters and hexbins shown (POIs and population cells
+    are tagged with their state once, in ``state_index``).
+
+    With ``stream_population`` the hex pyramid is aggregated from the population CSV in
+    chunks (``DataLoader.stream_population_pyramid``) and the ``load`` stage skips the
+    population grid; state tagging, model training and cluster labelling read the compact
+    table of ``DataLoader.read_population`` instead.
+    With ``parallel_workers`` the hexbin scoring, clustering and spider stages run per
+    region partition in a pool of that many processes (``parallel_regions``).
+    """
+    pipeline = Pipeline()
+    pipeline.add_stage("load", partial(_load, loader, not stream_population), params=["dataset_fingerprint"])
+    if stream_population:
+        pipeline.add_stage("population", partial(_read_population, loader), params=["dataset_fingerprint"])
+    else:
+        pipeline.add_stage("population", _loaded_population, inputs=["load"])
+    pipeline.add_stage("state_index", _state_index, inputs=["load", "population"])
+    pipeline.add_stage("state_filter", _state_filter, inputs=["load", "state_index"], params=["target_states"])
+    pipeline.add_stage("poi_h3_index", _poi_h3, inputs=["state_filter"])
+    if stream_population:
+        pipeline.add_stage("hex_pyramid", partial(_streamed_hex_pyramid, loader), params=["dataset_fingerprint"],
+                           max_entries=1)
+    else:
+        pipeline.add_stage("hex_pyramid", partial(_hex_pyramid, loader, cache_dir), inputs=["load"], max_entries=1)
+    pipeline.add_stage("hex_aggregation", partial(_hex_aggregation, loader), inputs=["hex_pyramid"],
+                       params=["hex_resolution"])
+    pipeline.add_stage("hex_state_filter", _hex_state_filter, inputs=["population", "state_index", "hex_aggregation"],
+                       params=["hex_resolution", "target_states"])
+    pipeline.add_stage("model_training", partial(_model_training, loader, model_registry), inputs=["population"],
+                       params=["percentile", "scorer"], max_entries=len(SLIDER_PERCENTILES))
+    pipeline.add_stage("hex_prediction", partial(_hex_prediction, loader, parallel_workers),
+                       inputs=["hex_state_filter", "model_training"], params=["hex_resolution"])
+    pipeline.add_stage("coloring", partial(_coloring, loader), inputs=["hex_prediction"],
+                       params=["color_group", "color_buckets"])
+    pipeline.add_stage("clustering", partial(_clustering, cluster_csv, parallel_workers),
+                       inputs=["poi_h3_index", "population"], params=["eps_meters"], max_entries=8)
+    pipeline.add_stage("spider", partial(_spider, lrt_file, parallel_workers), inputs=["clustering"],
+                       params=["spider_km", "lrt_fingerprint"], max_entries=8)
+    pipeline.add_stage("map", _map_layers, inputs=["coloring", "clustering", "spider"])
+    return pipeline
+
+
+def pipeline_params(loader, lrt_file, percentile=75, eps_meters=100, spider_km=0.5, hex_resolution=7,
+                    target_states=("Selangor", "W.P. Kuala Lumpur", "W.P. Putrajaya"), scorer="threshold",
+                    color_group="parlimen", color_buckets=4):
+    """Parameters for ``build_pinpoint_pipeline``; source files enter through their fingerprints."""
+    sources = [loader.state_geojson, loader.poi_csv, loader.population_csv]
+    return {
+        "dataset_fingerprint": fingerprint(*[file_fingerprint(path) for path in sources if path]),
+        "lrt_fingerprint": file_fingerprint(lrt_file),
+        "target_states": sorted(target_states),
+        "percentile": percentile,
+        "scorer": scorer,
+        "eps_meters": eps_meters,
+        "spider_km": round(spider_km, 3),  # Float sliders can yield values like 0.30000000000000004
+        "hex_resolution": hex_resolution,
+        "color_group": color_group,
+        "color_buckets": color_buckets
+    }
@@ -0,0 +1,93 @@
+import time
+
+import pandas as pd
+
+from instrumentation import span
+from pipeline_cache import Memo, fingerprint
+
+
+class Stage:
+    """One pipeline step: ``func(*input_results, **params)``."""
+
+    def __init__(self, name, func, inputs=(), params=(), max_entries=4):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.params = tuple(params)
+        self.memo = Memo(max_entries=max_entries)
+        self.seconds = 0.0
+
+
+class PipelineRun(dict):
+    """Results of one ``Pipeline.run`` by stage name, with that run's per-stage timing records."""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+
+class Pipeline:
+    """Incremental executor for a DAG of stages.
+
+    Each stage's key is the hash of its upstream keys and its own parameter values, so a
+    parameter change only reruns the stages downstream of it; everything else is a cache hit.
+    Stages must treat their inputs as read-only because results are shared between runs.
+    One pipeline may serve several sessions at once, so each run's timings are returned
+    with its results rather than stored on the pipeline.
+    """
+
+    def __init__(self):
+        self.stages = {}
+
+    def add_stage(self, name, func, inputs=(), params=(), max_entries=4):
+        missing = [dep for dep in inputs if dep not in self.stages]
+        if missing:
+            raise ValueError(f"Stage '{name}' depends on unknown stages {missing}; add them first.")
+        self.stages[name] = Stage(name, func, inputs, params, max_entries)
+        return self
+
+    def _required(self, targets):
+        required = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name not in required:
+                required.add(name)
+                pending.extend(self.stages[name].inputs)
+        return required
+
+    def run(self, params, targets=None):
+        """Run the stages needed for ``targets`` (default: all); returns a ``PipelineRun`` of results by name."""
+        required = self._required(targets or self.stages)
+        keys = {}
+        results = PipelineRun()
+
+        # Stages are added after their inputs, so insertion order is a topological order
+        for name, stage in self.stages.items():
+            if name not in required:
+                continue
+
+            param_values = [params[param] for param in stage.params]
+            keys[name] = fingerprint(name, *[keys[dep] for dep in stage.inputs], *param_values)
+
+            computed = []
+            def compute(stage=stage, param_values=param_values):
+                computed.append(True)
+                return stage.func(*[results[dep] for dep in stage.inputs], **dict(zip(stage.params, param_values)))
+
+            start = time.perf_counter()
+            with span(f"stage:{name}") as stage_span:
+                results[name] = stage.memo.get(name, compute, keys[name])
+                stage_span.set(cached=not computed)
+            seconds = time.perf_counter() - start
+            stage.seconds += seconds
+            results.records.append({"stage": name, "cached": not computed, "seconds": seconds, "key": keys[name]})
+
+        return results
+
+    def report(self, run):
+        """Timing of a run (a ``PipelineRun``) per stage, with cumulative cache hits and misses."""
+        rows = [{**record, "hits": self.stages[record["stage"]].memo.hits,
+                 "misses": self.stages[record["stage"]].memo.misses,
+                 "total_seconds": self.stages[record["stage"]].seconds} for record in run.records]
+        return pd.DataFrame(rows, columns=["stage", "cached", "seconds", "hits", "misses", "total_seconds", "key"])
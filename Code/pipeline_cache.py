@@ -0,0 +1,59 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+def fingerprint(*parts):
+    """Hash of plain values (strings, numbers, tuples of them), used as a memoization key."""
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(repr(part).encode())
+        digest.update(b"|")
+    return digest.hexdigest()[:16]
+
+
+def write_atomic(path, write):
+    """Call ``write(tmp_path)`` and move the result to ``path``, so readers never see a partial file.
+
+    Processes sharing a cache directory may write the same file at once; the last rename wins.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class Memo:
+    """Small LRU of stage results keyed by the fingerprints of their inputs and parameters.
+
+    A stage only recomputes when one of its dependencies actually changes, whichever
+    widget or session triggered the rerun.
+    """
+
+    def __init__(self, max_entries=16):
+        self.max_entries = max_entries
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name, compute, *dependencies):
+        """Return the cached result of ``name`` for these dependencies, calling ``compute()`` on a miss."""
+        key = (name, fingerprint(*dependencies))
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return self._results[key]
+
+        result = compute()
+        with self._lock:
+            self.misses += 1
+            self._results[key] = result
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+        return result
@@ -1,10 +1,78 @@
-import h3
+import base64
+import hashlib
+import json
+import mimetypes
+import os
+import urllib.request
+
 import folium
 import geopandas as gpd
+from folium.plugins import FastMarkerCluster
+
+from h3_index import cells_to_polygons, latlng_to_cells
+from instrumentation import count, get_logger, traced
+from region_index import REGION_COLUMN
+
+POI_LAYER_MODES = ("markers", "cluster", "geojson", "h3")
+
+logger = get_logger("poi_layer")
+
+# Runs once in the browser: one Leaflet icon per brand, shared by all of that brand's markers
+CLUSTER_CALLBACK = """(function () {
+    var urls = %s;
+    var fallback = %s;
+    var icons = {};
+    return function (row) {
+        var brand = row[2];
+        if (!(brand in icons)) {
+            icons[brand] = L.icon({iconUrl: urls[brand] || fallback, iconSize: [25, 25]});
+        }
+        return L.marker(new L.LatLng(row[0], row[1]), {icon: icons[brand]}).bindTooltip(brand);
+    };
+})()"""
+
+
+class IconCache:
+    """Local copies of remote icon images, inlined as data URIs so maps work offline."""
+
+    def __init__(self, cache_dir, timeout=5):
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self._uris = {}
+
+    def data_uri(self, url):
+        """Inlined image for ``url``; falls back to the remote URL if it was never downloaded and cannot be."""
+        if url in self._uris:
+            return self._uris[url]
+
+        path = os.path.join(self.cache_dir, hashlib.sha1(url.encode()).hexdigest())
+        if not os.path.exists(path):
+            try:
+                request = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0"})
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    content_type = response.headers.get_content_type()
+                    data = response.read()
+            except OSError as e:
+                logger.warning(f"⚠️ Could not fetch icon {url}: {e}")
+                self._uris[url] = url  # Don't retry (and wait for the timeout again) on every marker
+                return url
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+            with open(path + ".type", "w") as f:
+                f.write(content_type)
+
+        with open(path + ".type") as f:
+            content_type = f.read().strip() or mimetypes.guess_type(url)[0] or "image/png"
+        with open(path, "rb") as f:
+            self._uris[url] = f"data:{content_type};base64,{base64.b64encode(f.read()).decode()}"
+        return self._uris[url]
+
 
 class POIProcessor:
-    def __init__(self, hex_resolution=7):
+    def __init__(self, hex_resolution=7, icon_cache_dir=None):
         self.hex_resolution = hex_resolution
+        self.icon_cache = IconCache(icon_cache_dir) if icon_cache_dir else None
         self.brand_icons = {
             "7Cafe": "https://www.ekocherasmall.com/images/uploads/20221229162220_7%20Cafe%20logo_color%20only.jpg",
             "7Eleven": "https://1000logos.net/wp-content/uploads/2020/09/7-Eleven-Logo-1968.png",
@@ -28,32 +96,85 @@ class POIProcessor:
         }
         self.DEFAULT_ICON_URL = "https://upload.wikimedia.org/wikipedia/commons/8/88/Map_marker.svg"
 
-    def filter_pois(self, gdf_poi, gdf_selected_states):
-        """Filter POIs within the selected states."""
-        return gdf_poi[gdf_poi.within(gdf_selected_states.unary_union)]
+    @traced("POIProcessor.filter_pois")
+    def filter_pois(self, gdf_poi, gdf_selected_states, region_index=None):
+        """Filter POIs within the selected states.
 
+        With a ``region_index.RegionIndex`` the dissolved state geometry is cached per selection,
+        and POIs already tagged by ``RegionIndex.tag_states`` are filtered with a plain mask.
+        """
+        count("rows_in", len(gdf_poi))
+        if region_index is None:
+            mask = gdf_poi.within(gdf_selected_states.unary_union)
+        elif REGION_COLUMN in gdf_poi.columns:
+            mask = gdf_poi[REGION_COLUMN].isin(gdf_selected_states["state"].unique())
+        else:
+            mask = region_index.within_mask(gdf_poi.geometry.x.to_numpy(), gdf_poi.geometry.y.to_numpy(),
+                                            gdf_selected_states["state"].unique())
+        filtered = gdf_poi[mask]
+        count("rows_out", len(filtered))
+        return filtered
+
+    @traced("POIProcessor.assign_poi_to_hex")
     def assign_poi_to_hex(self, gdf_poi):
         """Assign POIs to hexagons based on their latitude/longitude."""
-        gdf_poi["hex"] = gdf_poi.apply(lambda row: h3.latlng_to_cell(row.geometry.y, row.geometry.x, self.hex_resolution), axis=1)
+        gdf_poi["hex"] = latlng_to_cells(gdf_poi.geometry.y.to_numpy(), gdf_poi.geometry.x.to_numpy(), self.hex_resolution)
+        count("rows_in", len(gdf_poi))
+        count("hexagons", gdf_poi["hex"].nunique())
         return gdf_poi
 
-    def add_poi_layer(self, gdf_poi, folium_map):
-        """Add POI markers with brand-specific icons to the map."""
-        print("🔹 Adding POI Layer to Map...")
+    def icon_url(self, brand):
+        """Brand logo (inlined from the local icon cache when configured), or the default marker."""
+        url = self.brand_icons.get(brand, self.DEFAULT_ICON_URL)  # Get brand-specific icon or default
+        return self.icon_cache.data_uri(url) if self.icon_cache else url
 
-        poi_layer = folium.FeatureGroup(name="Points of Interest (POI)")
+    @traced("POIProcessor.add_poi_layer")
+    def add_poi_layer(self, gdf_poi, folium_map, mode="markers", aggregate_resolution=6):
+        """Add POI markers with brand-specific icons to the map.
+
+        Modes:
+        - "markers": one folium marker per POI (small datasets only)
+        - "cluster": all POIs in one marker-cluster layer built from a single data array,
+          with one shared icon per brand
+        - "geojson": one GeoJSON layer of plain circle markers
+        - "h3": POI counts aggregated into H3 cells at ``aggregate_resolution``
+        """
+        if mode not in POI_LAYER_MODES:
+            raise ValueError(f"Unknown POI layer mode '{mode}', expected one of {POI_LAYER_MODES}")
+        logger.info("🔹 Adding POI Layer to Map...")
+        count("rows_in", len(gdf_poi))
 
         # Ensure "Brand" column exists
         if "Brand" not in gdf_poi.columns:
             gdf_poi["Brand"] = "Unknown"
 
+        if mode == "markers":
+            poi_layer = self._marker_layer(gdf_poi)
+        elif mode == "cluster":
+            poi_layer = self._cluster_layer(gdf_poi)
+        elif mode == "geojson":
+            poi_layer = folium.GeoJson(
+                gdf_poi[["Brand", "geometry"]],
+                name="Points of Interest (POI)",
+                marker=folium.CircleMarker(radius=4, fill=True, fill_opacity=0.8, weight=1),
+                tooltip=folium.GeoJsonTooltip(fields=["Brand"], labels=False)
+            )
+        else:
+            poi_layer = self._h3_layer(gdf_poi, aggregate_resolution)
+
+        folium_map.add_child(poi_layer)
+        logger.info("✅ POI Layer Added to Map.")
+
+    def _marker_layer(self, gdf_poi):
+        poi_layer = folium.FeatureGroup(name="Points of Interest (POI)")
+        icon_urls = {brand: self.icon_url(brand) for brand in gdf_poi["Brand"].unique()}
+
         for _, row in gdf_poi.iterrows():
             brand = row["Brand"]
-            icon_url = self.brand_icons.get(brand, self.DEFAULT_ICON_URL)  # Get brand-specific icon or default
 
             # Create a custom icon for the POI
             icon = folium.CustomIcon(
-                icon_url,
+                icon_urls[brand],
                 icon_size=(25, 25)  # Adjust the size of the logo
             )
 
@@ -64,5 +185,31 @@ class POIProcessor:
                 tooltip=f"{brand}"  # Display brand name when hovered
             ).add_to(poi_layer)
 
-        folium_map.add_child(poi_layer)
-        print("✅ POI Layer Added to Map.")
+        return poi_layer
+
+    def _cluster_layer(self, gdf_poi):
+        brands = gdf_poi["Brand"].astype(str)
+        data = [list(row) for row in zip(gdf_poi.geometry.y.tolist(), gdf_poi.geometry.x.tolist(), brands.tolist())]
+        icon_urls = {brand: self.icon_url(brand) for brand in brands.unique()}
+        default_url = self.icon_cache.data_uri(self.DEFAULT_ICON_URL) if self.icon_cache else self.DEFAULT_ICON_URL
+        callback = CLUSTER_CALLBACK % (json.dumps(icon_urls), json.dumps(default_url))
+        return FastMarkerCluster(
+            data,
+            callback=callback,
+            name="Points of Interest (POI)",
+            options={"disableClusteringAtZoom": 16, "chunkedLoading": True}
+        )
+
+    def _h3_layer(self, gdf_poi, resolution):
+        cells = latlng_to_cells(gdf_poi.geometry.y.to_numpy(), gdf_poi.geometry.x.to_numpy(), resolution)
+        counts = gdf_poi.assign(cell=cells).groupby("cell").agg(
+            poi_count=("Brand", "size"),
+            top_brand=("Brand", lambda brands: brands.mode().iat[0])
+        ).reset_index()
+        counts = gpd.GeoDataFrame(counts, geometry=cells_to_polygons(counts["cell"].to_numpy()), crs="EPSG:4326")
+        return folium.GeoJson(
+            counts,
+            name="Points of Interest (POI, aggregated)",
+            style_function=lambda feature: {"fillColor": "#3186cc", "color": "#3186cc", "weight": 1, "fillOpacity": 0.5},
+            tooltip=folium.GeoJsonTooltip(fields=["poi_count", "top_brand"], aliases=["POIs:", "Top brand:"])
+        )
@@ -0,0 +1,11 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+def spawn_pool(max_workers=None):
+    """``ProcessPoolExecutor`` whose workers are spawned, never forked.
+
+    Forking Streamlit's multi-threaded server process is unsafe: a child can inherit locks
+    held by other threads. Spawned workers start a fresh interpreter and import what they need.
+    """
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
@@ -0,0 +1,51 @@
+import numpy as np
+import shapely
+
+REGION_COLUMN = "region_state"
+
+
+class RegionIndex:
+    """Point-in-state lookups over the administrative state boundaries.
+
+    Dissolved, prepared geometries are cached per state selection, and an STRtree over
+    the individual states lets whole frames be tagged with their state in one query.
+    """
+
+    def __init__(self, gdf_states, name_column="state"):
+        self.names = gdf_states[name_column].to_numpy()
+        self.geometries = np.asarray(gdf_states.geometry.to_numpy(), dtype=object)
+        self.tree = shapely.STRtree(self.geometries)
+        self._regions = {}
+
+    def region(self, states):
+        """Dissolved and prepared geometry of a state selection, with its bounding box."""
+        key = frozenset(states)
+        if key not in self._regions:
+            union = shapely.union_all(self.geometries[np.isin(self.names, list(key))])
+            shapely.prepare(union)
+            self._regions[key] = (union, union.bounds)
+        return self._regions[key]
+
+    def within_mask(self, x, y, states):
+        """Boolean mask of the points (lon ``x``, lat ``y``) inside the selected states."""
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        union, (minx, miny, maxx, maxy) = self.region(states)
+
+        # Cheap bounding box prefilter before the exact test
+        mask = (x >= minx) & (x <= maxx) & (y >= miny) & (y <= maxy)
+        if mask.any():
+            mask[mask] = shapely.contains_xy(union, x[mask], y[mask])
+        return mask
+
+    def state_of(self, x, y):
+        """State name for each point, or None for points outside every state."""
+        points = shapely.points(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        point_idx, state_idx = self.tree.query(points, predicate="within")
+        states = np.full(len(points), None, dtype=object)
+        states[point_idx] = self.names[state_idx]
+        return states
+
+    def tag_states(self, gdf):
+        """Copy of ``gdf`` with a precomputed ``region_state`` column, so later filters are a mask."""
+        return gdf.assign(**{REGION_COLUMN: self.state_of(gdf.geometry.x.to_numpy(), gdf.geometry.y.to_numpy())})
@@ -1,79 +1,174 @@
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import MultiPoint
+import shapely
 from sklearn.cluster import DBSCAN
-from scipy.spatial.distance import cdist
+from sklearn.neighbors import BallTree
+from scipy.sparse import csr_matrix
+from scipy.spatial import cKDTree
+
+from instrumentation import count, get_logger, traced
+
+EARTH_RADIUS_M = 6371008.8
+MAX_CACHED_GRAPHS = 4
+
+logger = get_logger("clustering")
+
+# (coordinate hash, max eps) -> HaversineNeighborGraph, reused across Streamlit reruns
+_graph_cache = {}
+# coordinate hash -> cKDTree over population cell (lat, lon)
+_population_trees = {}
+# Background writer for optional CSV exports, so the UI never waits on disk I/O
+_export_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cluster-export")
+
+
+class HaversineNeighborGraph:
+    """Sparse radius-neighbors graph of great-circle distances (meters), computed once at the largest eps.
+
+    Any smaller eps is derived by masking the cached distances, so no distances are recomputed.
+    """
+
+    def __init__(self, lat, lon, max_eps_meters):
+        coords = np.radians(np.column_stack([lat, lon]))
+        n = len(coords)
+        self.max_eps_meters = max_eps_meters
+
+        tree = BallTree(coords, metric="haversine")
+        neighbors, distances = tree.query_radius(coords, r=max_eps_meters / EARTH_RADIUS_M,
+                                                 return_distance=True, sort_results=True)
+        counts = np.array([len(idx) for idx in neighbors], dtype=np.int64)
+        self._rows = np.repeat(np.arange(n), counts)
+        self.graph = csr_matrix(
+            (np.concatenate(distances) * EARTH_RADIUS_M, np.concatenate(neighbors), np.concatenate([[0], np.cumsum(counts)])),
+            shape=(n, n)
+        )
+
+    def within(self, eps_meters):
+        """Graph restricted to pairs at most ``eps_meters`` apart (explicit zeros kept for duplicate points)."""
+        if eps_meters > self.max_eps_meters:
+            raise ValueError(f"eps {eps_meters} m exceeds the cached graph radius {self.max_eps_meters} m")
+        keep = self.graph.data <= eps_meters
+        n = self.graph.shape[0]
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(self._rows[keep], minlength=n))])
+        return csr_matrix((self.graph.data[keep], self.graph.indices[keep], indptr), shape=(n, n))
+
+
+def neighbor_graph(lat, lon, max_eps_meters):
+    """Cached ``HaversineNeighborGraph`` for a coordinate set."""
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    key = (hashlib.sha1(lat.tobytes() + lon.tobytes()).hexdigest(), max_eps_meters)
+    if key not in _graph_cache:
+        if len(_graph_cache) >= MAX_CACHED_GRAPHS:
+            _graph_cache.pop(next(iter(_graph_cache)))
+        _graph_cache[key] = HaversineNeighborGraph(lat, lon, max_eps_meters)
+    return _graph_cache[key]
+
+
+def nearest_population_index(population, lat, lon):
+    """Positional index of the closest population cell (in lat/lon degrees) for each query point."""
+    if len(lat) == 0:
+        return np.array([], dtype=np.int64)
+    population_coords = population[["Lat", "Lon"]].to_numpy(dtype=float)
+    key = hashlib.sha1(population_coords.tobytes()).hexdigest()
+    if key not in _population_trees:
+        _population_trees.clear()  # One population grid is in use at a time
+        _population_trees[key] = cKDTree(population_coords)
+    _, idx = _population_trees[key].query(np.column_stack([lat, lon]))
+    return idx
+
 
 class POIClustering:
-    def __init__(self, eps_distance=100 / 111000, min_samples=3, output_csv="Clustered_POIs.csv"):
-        self.eps_distance = eps_distance  # ~100 meters in degrees
+    def __init__(self, eps_distance=100 / 111000, min_samples=3, output_csv="Clustered_POIs.csv",
+                 eps_meters=None, max_eps_meters=500, export_async=False):
+        self.eps_distance = eps_distance  # ~100 meters in degrees, kept for callers that still pass degrees
+        self.eps_meters = eps_meters if eps_meters is not None else eps_distance * 111000
+        self.max_eps_meters = max(max_eps_meters, self.eps_meters)  # Radius of the cached neighbor graph
         self.min_samples = min_samples
-        self.output_csv = output_csv
+        self.output_csv = output_csv  # None skips the CSV export
+        self.export_async = export_async
+        self.export_future = None
+        self.core_mask = None  # DBSCAN core points of the last cluster_pois() call
 
+    @traced("POIClustering.cluster_pois")
     def cluster_pois(self, gdf_poi):
-        """Apply DBSCAN clustering to POI point data."""
-        print("🔹 Running DBSCAN Clustering...")
-
-        poi_coords = np.array(list(zip(gdf_poi.geometry.y, gdf_poi.geometry.x)))
-        dbscan = DBSCAN(eps=self.eps_distance, min_samples=self.min_samples, metric="euclidean")
-        gdf_poi["cluster"] = dbscan.fit_predict(poi_coords)
-
-        print(f"✅ DBSCAN completed. Total clusters (excluding noise): {len(set(gdf_poi['cluster'])) - (1 if -1 in gdf_poi['cluster'] else 0)}")
+        """Apply DBSCAN clustering to POI point data using great-circle distances."""
+        logger.info("🔹 Running DBSCAN Clustering...")
+        count("rows_in", len(gdf_poi))
+
+        self.core_mask = np.zeros(len(gdf_poi), dtype=bool)
+        if gdf_poi.empty:
+            gdf_poi["cluster"] = np.array([], dtype=np.int64)
+            return gdf_poi
+
+        graph = neighbor_graph(gdf_poi.geometry.y.to_numpy(), gdf_poi.geometry.x.to_numpy(), self.max_eps_meters)
+        dbscan = DBSCAN(eps=self.eps_meters, min_samples=self.min_samples, metric="precomputed")
+        gdf_poi["cluster"] = dbscan.fit_predict(graph.within(self.eps_meters))
+        self.core_mask[dbscan.core_sample_indices_] = True
+
+        n_clusters = len(set(gdf_poi["cluster"]) - {-1})
+        count("clusters", n_clusters)
+        count("noise", int((gdf_poi["cluster"] == -1).sum()))
+        logger.info(f"✅ DBSCAN completed. Total clusters (excluding noise): {n_clusters}")
         return gdf_poi
 
-    def generate_cluster_polygons(self, gdf_poi, gdf_population):
-        """Generate convex hull polygons for each DBSCAN cluster."""
-        print("🔹 Generating Cluster Polygons...")
-
-        cluster_polygons = []
-        cluster_info = []
-
-        for cluster_id in sorted(set(gdf_poi["cluster"])):
-            if cluster_id == -1:
-                continue  # Skip noise
-
-            cluster_points = gdf_poi[gdf_poi["cluster"] == cluster_id].geometry
-            total_poi = len(cluster_points)
-
-            if total_poi < 3:
-                print(f"⚠️ Skipping cluster {cluster_id} (only {total_poi} POIs)")
-                continue
-
-            hull = MultiPoint(cluster_points.tolist()).convex_hull
-            centroid = hull.centroid
-
-            # Find closest population centroid
-            population_coords = np.array(list(zip(gdf_population.geometry.y, gdf_population.geometry.x)))
-            cluster_centroid_coords = np.array([[centroid.y, centroid.x]])
-
-            closest_idx = np.argmin(cdist(cluster_centroid_coords, population_coords))
-            closest_population = gdf_population.iloc[closest_idx]
-
-            cluster_polygons.append({
-                "Cluster_ID": cluster_id,
-                "Centroid_Lat": centroid.y,
-                "Centroid_Lon": centroid.x,
-                "Total_POI": total_poi,
-                "Parlimen": closest_population["parlimen"],
-                "Dun": closest_population["dun"],
-                "geometry": hull
-            })
-
-            cluster_info.append({
-                "Cluster_ID": cluster_id,
-                "Centroid_Lat": centroid.y,
-                "Centroid_Lon": centroid.x,
-                "Total_POI": total_poi,
-                "Parlimen": closest_population["parlimen"],
-                "Dun": closest_population["dun"]
-            })
+    @traced("POIClustering.generate_cluster_polygons")
+    def generate_cluster_polygons(self, gdf_poi, population):
+        """Generate convex hull polygons for all DBSCAN clusters in one batch."""
+        logger.info("🔹 Generating Cluster Polygons...")
+
+        clustered = gdf_poi[gdf_poi["cluster"] != -1]
+        sizes = clustered.groupby("cluster").size()
+        skipped = sizes[sizes < 3]
+        if not skipped.empty:
+            logger.info(f"⚠️ Skipping {len(skipped)} clusters with fewer than 3 POIs")
+        cluster_ids = sizes.index[sizes >= 3]
+        count("skipped_clusters", len(skipped))
+        count("polygons", len(cluster_ids))
+
+        clustered = clustered[clustered["cluster"].isin(cluster_ids)]
+        codes = pd.Categorical(clustered["cluster"], categories=cluster_ids).codes
+        order = np.argsort(codes, kind="stable")  # multipoints() needs grouped, increasing indices
+
+        if len(cluster_ids):
+            coords = np.column_stack([clustered.geometry.x.to_numpy(), clustered.geometry.y.to_numpy()])[order]
+            hulls = shapely.convex_hull(shapely.multipoints(coords, indices=codes[order]))
+        else:
+            hulls = np.array([], dtype=object)
+        centroids = shapely.centroid(hulls)
+        centroid_lat = shapely.get_y(centroids)
+        centroid_lon = shapely.get_x(centroids)
+
+        # Closest population cell for every cluster centroid, from one tree over the grid
+        closest_population = population.iloc[nearest_population_index(population, centroid_lat, centroid_lon)]
+
+        df_cluster_info = pd.DataFrame({
+            "Cluster_ID": cluster_ids.to_numpy(),
+            "Centroid_Lat": centroid_lat,
+            "Centroid_Lon": centroid_lon,
+            "Total_POI": sizes.loc[cluster_ids].to_numpy(),
+            "Parlimen": closest_population["parlimen"].to_numpy(),
+            "Dun": closest_population["dun"].to_numpy()
+        })
 
         # Save CSV
-        df_cluster_info = pd.DataFrame(cluster_info)
-        df_cluster_info.to_csv(self.output_csv, index=False)
-        print(f"✅ Cluster info saved to {self.output_csv}")
+        if self.output_csv:
+            self.export_cluster_info(df_cluster_info)
 
         # Return GeoDataFrame
-        cluster_gdf = gpd.GeoDataFrame(cluster_polygons, crs="EPSG:4326")
+        cluster_gdf = gpd.GeoDataFrame(df_cluster_info, geometry=hulls, crs="EPSG:4326")
         return cluster_gdf
+
+    def export_cluster_info(self, df_cluster_info):
+        """Write the cluster table to ``output_csv``, on the background writer if ``export_async``."""
+        def write():
+            df_cluster_info.to_csv(self.output_csv, index=False)
+            logger.info(f"✅ Cluster info saved to {self.output_csv}")
+
+        if self.export_async:
+            self.export_future = _export_pool.submit(write)
+        else:
+            write()
@@ -1,84 +1,214 @@
 # 1. hexbin_layer.py (Modified for Streamlit)
 
-import h3
+import time
+from abc import ABC, abstractmethod
+
 import geopandas as gpd
 import numpy as np
+import pandas as pd
 import folium
-from shapely.geometry import Polygon
-from tqdm import tqdm
-from sklearn.ensemble import RandomForestClassifier
+
+from h3_index import latlng_to_cells, cells_to_polygons
+from hex_pyramid import HEX_AGGREGATIONS
+from instrumentation import count, traced
+from model_registry import HGB_HYPERPARAMETERS, fit_hist_gradient_boosting_model
+
+FEATURE_COLUMNS = [
+    "population_every_1km2", "income_avg", "expenditure_avg",
+    "ethnicity_proportion_bumi", "ethnicity_proportion_chinese", "ethnicity_proportion_indian",
+    "age_proportion_0_14", "age_proportion_15_64", "age_proportion_18_above", "age_proportion_65_above"
+]
+
+
+def fill_hex_features(hex_population):
+    """Copy of the hex table with numeric gaps filled by the column median, as the scorers expect."""
+    hex_population = hex_population.copy()
+    numeric_cols = hex_population.select_dtypes(include=[np.number]).columns
+    hex_population[numeric_cols] = hex_population[numeric_cols].apply(lambda x: x.fillna(x.median()), axis=0)
+    return hex_population
+
+
+class SuitabilityScorer(ABC):
+    """Scores hexagons from their ``FEATURE_COLUMNS``: ``predict(X)`` returns 1 for suitable, 0 otherwise."""
+
+    name = "scorer"
+
+    @abstractmethod
+    def predict(self, X):
+        """Suitability labels (0/1) for the rows of ``X``."""
+
+
+class ThresholdScorer(SuitabilityScorer):
+    """The suitability rule itself (population above the threshold) as one vectorized comparison."""
+
+    name = "threshold"
+
+    def __init__(self, threshold, column="population_every_1km2"):
+        self.threshold = threshold
+        self.column = column
+
+    def predict(self, X):
+        return (X[self.column].to_numpy() > self.threshold).astype(int)
+
+
+class RandomForestScorer(SuitabilityScorer):
+    """Wraps a fitted RandomForest suitability model."""
+
+    name = "random_forest"
+
+    def __init__(self, model):
+        self.model = model
+
+    def predict(self, X):
+        return self.model.predict(X)
+
+
+class HistGradientBoostingScorer(SuitabilityScorer):
+    """Lightweight learned scorer: histogram gradient boosting, much cheaper to fit and predict than the forest."""
+
+    name = "hist_gradient_boosting"
+
+    def __init__(self, model=None, **params):
+        self.model = model
+        self.params = {**HGB_HYPERPARAMETERS, **params}
+
+    def fit(self, X_train, threshold):
+        self.model = fit_hist_gradient_boosting_model(X_train[FEATURE_COLUMNS], threshold, self.params)
+        return self
+
+    def predict(self, X):
+        return self.model.predict(X)
+
+
+def benchmark_scorers(scorers, hex_population, reference=None, repeats=5):
+    """Latency and agreement of each scorer on a hex table.
+
+    ``agreement`` is the share of hexagons labelled the same as the ``reference`` scorer
+    (default: the first one).
+    """
+    X_hex = fill_hex_features(hex_population)[FEATURE_COLUMNS]
+    reference = reference or scorers[0]
+    reference_pred = np.asarray(reference.predict(X_hex))
+
+    rows = []
+    for scorer in scorers:
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            pred = np.asarray(scorer.predict(X_hex))
+            timings.append(time.perf_counter() - start)
+        rows.append({
+            "scorer": scorer.name,
+            "latency_ms": 1000 * min(timings),
+            "suitable_share": float(np.mean(pred == 1)),
+            "agreement": float(np.mean(pred == reference_pred))
+        })
+    return pd.DataFrame(rows, columns=["scorer", "latency_ms", "suitable_share", "agreement"])
+
 
 class HexbinGenerator:
     def __init__(self, data_loader, rf_model, hex_resolution=7):
         self.data_loader = data_loader
-        self.rf_model = rf_model
+        self.rf_model = rf_model  # Any object with predict(X), e.g. a SuitabilityScorer
         self.hex_resolution = hex_resolution
 
-    def generate_hexbins_with_ml(self):
-        gdf_poi, gdf_population, _ = self.data_loader.load_data()
-
-        if gdf_population is None or gdf_population.empty:
-            return None
+    @traced("HexbinGenerator.aggregate_population")
+    def aggregate_population(self, gdf_population=None, h3_index=None, pyramid=None):
+        """Aggregate the population grid to hexagons at ``self.hex_resolution``.
 
-        gdf_population["hex"] = gdf_population.apply(
-            lambda row: h3.latlng_to_cell(row.geometry.y, row.geometry.x, self.hex_resolution), axis=1
-        )
+        A built ``hex_pyramid.HexPyramid`` turns this into a lookup; otherwise the grid is
+        grouped directly, reusing cells from an ``h3_index.MultiResolutionIndex`` if given.
+        """
+        if pyramid is not None and self.hex_resolution in pyramid.resolutions:
+            hex_population = pyramid.level(self.hex_resolution)
+            count("hexagons", len(hex_population))
+            return hex_population
 
-        hex_population = gdf_population.groupby("hex").agg({
-            "population_every_1km2": "sum",
-            "state": "first", "parlimen": "first", "dun": "first",
-            "ethnicity_proportion_bumi": "mean", "ethnicity_proportion_chinese": "mean", "ethnicity_proportion_indian": "mean",
-            "age_proportion_0_14": "mean", "age_proportion_15_64": "mean", "age_proportion_18_above": "mean", "age_proportion_65_above": "mean",
-            "income_avg": "mean", "expenditure_avg": "mean"
-        }).reset_index()
+        if gdf_population is None:
+            _, gdf_population, _ = self.data_loader.load_data()
 
-        numeric_cols = hex_population.select_dtypes(include=[np.number]).columns
-        hex_population[numeric_cols] = hex_population[numeric_cols].apply(lambda x: x.fillna(x.median()), axis=0)
+        if gdf_population is None or gdf_population.empty:
+            return None
 
-        feature_columns = [
-            "population_every_1km2", "income_avg", "expenditure_avg",
-            "ethnicity_proportion_bumi", "ethnicity_proportion_chinese", "ethnicity_proportion_indian",
-            "age_proportion_0_14", "age_proportion_15_64", "age_proportion_18_above", "age_proportion_65_above"
-        ]
+        if h3_index is not None:
+            hex_ids = h3_index.cells(self.hex_resolution)
+        else:
+            hex_ids = latlng_to_cells(gdf_population.geometry.y.to_numpy(), gdf_population.geometry.x.to_numpy(),
+                                      self.hex_resolution)
+        gdf_population = gdf_population.assign(hex=hex_ids)
+
+        hex_population = gdf_population.groupby("hex").agg(HEX_AGGREGATIONS).reset_index()
+        count("rows_in", len(gdf_population))
+        count("hexagons", len(hex_population))
+        return hex_population
+
+    @traced("HexbinGenerator.generate_hexbins_with_ml")
+    def generate_hexbins_with_ml(self, gdf_population=None, h3_index=None, pyramid=None):
+        """Aggregate the population grid into predicted-suitable hexagons.
+
+        Pass an already-loaded ``gdf_population`` to avoid going back to the data loader.
+        The input frame is not modified.
+        """
+        hex_population = self.aggregate_population(gdf_population, h3_index=h3_index, pyramid=pyramid)
+        return self.predict_hexbins(hex_population)
+
+    @traced("HexbinGenerator.predict_hexbins")
+    def predict_hexbins(self, hex_population):
+        """Keep the hexagons the model/scorer predicts as suitable and attach their polygons (input is not modified)."""
+        if hex_population is None or hex_population.empty:
+            return None
 
-        X_hex = hex_population[feature_columns]
+        hex_population = fill_hex_features(hex_population)
+        X_hex = hex_population[FEATURE_COLUMNS]
         y_hex_pred = self.rf_model.predict(X_hex)
 
         hex_population["suitability_pred"] = y_hex_pred
         hex_population = hex_population[hex_population["suitability_pred"] == 1]
+        count("rows_in", len(X_hex))
+        count("suitable_hexagons", len(hex_population))
 
         if hex_population.empty:
             return None
 
-        hex_population["geometry"] = [
-            Polygon([tuple(reversed(coord)) for coord in h3.cell_to_boundary(hex_id)])
-            for hex_id in tqdm(hex_population["hex"], desc="Processing Hexagons")
-        ]
+        hex_population["geometry"] = cells_to_polygons(hex_population["hex"].to_numpy())
 
         gdf_hex = gpd.GeoDataFrame(hex_population, geometry="geometry", crs="EPSG:4326")
         return gdf_hex
 
     def assign_colors_by_parlimen(self, gdf_hex):
-        gdf_hex["color"] = None  # or you can skip this entirely
-
-        for parlimen, group in gdf_hex.groupby("parlimen"):
-            pop_values = group["population_every_1km2"]
-            q25, q50, q75 = np.percentile(pop_values, [25, 50, 75])
-
-            def assign_color(val):
-                if val < q25:
-                    return "<Q25"     # Red for values below 25th percentile
-                elif val < q50:
-                    return "<Q50"  # Yellow for values between 25th and 50th percentile
-                elif val < q75:
-                    return "<Q75"   # Green for values between 50th and 75th percentile
-                else:
-                    return ">Q75"   # Green for values above 75th percentile
-
-            gdf_hex.loc[group.index, "color"] = group["population_every_1km2"].apply(assign_color)
-
+        return self.assign_quantile_buckets(gdf_hex, group_col="parlimen")
+
+    @traced("HexbinGenerator.assign_quantile_buckets")
+    def assign_quantile_buckets(self, gdf_hex, group_col="parlimen", value_col="population_every_1km2",
+                                n_buckets=4, output_col="color", breakpoints=None):
+        """Label each hexagon with its within-group quantile bucket ("<Q25", "<Q50", "<Q75", ">Q75" for 4 buckets).
+
+        Breakpoints are computed per group in one grouped quantile; pass ``breakpoints`` (from
+        ``quantile_breakpoints``) to reuse a fixed set. Hexagons without a group get None.
+        """
+        if n_buckets < 2:
+            raise ValueError(f"n_buckets must be at least 2, got {n_buckets}")
+        quantiles = np.arange(1, n_buckets) / n_buckets
+        labels = [f"<Q{round(100 * q)}" for q in quantiles] + [f">Q{round(100 * quantiles[-1])}"]
+        if breakpoints is None:
+            breakpoints = self.quantile_breakpoints(gdf_hex, group_col, value_col, n_buckets)
+
+        groups = gdf_hex[group_col]
+        row_breakpoints = breakpoints.reindex(groups.to_numpy()).to_numpy()
+        values = gdf_hex[value_col].to_numpy(dtype=float)[:, None]
+        # Bucket = number of breakpoints the value is not below (NaN breakpoints fall through to the top bucket)
+        buckets = (~(values < row_breakpoints)).sum(axis=1)
+
+        colors = np.asarray(labels, dtype=object)[buckets]
+        colors[groups.isna().to_numpy()] = None
+        gdf_hex[output_col] = colors
         return gdf_hex
 
+    def quantile_breakpoints(self, gdf_hex, group_col="parlimen", value_col="population_every_1km2", n_buckets=4):
+        """Per-group quantile breakpoints (one row per group, one column per quantile)."""
+        quantiles = list(np.arange(1, n_buckets) / n_buckets)
+        return gdf_hex.groupby(group_col)[value_col].quantile(quantiles).unstack()
+
 
     # def plot_filtered_hexbin_map(self, gdf_hex):
     #     hexbin_layer = folium.FeatureGroup(name="Filtered Hexbins")
@@ -1,25 +1,40 @@
 import streamlit as st
-import pandas as pd
-import geopandas as gpd
-import numpy as np
-from sklearn.ensemble import RandomForestClassifier
 from streamlit_keplergl import keplergl_static
 from keplergl import KeplerGl
 
+from batch_precompute import load_precomputed
 from data_loader import DataLoader
-from streamlitHexbin import HexbinGenerator
-from streamlitDBSCAN import POIClustering
-from poi_layer import POIProcessor
-from streamlitSpider import SpiderMapLayer
+from dataset_registry import registry
+from instrumentation import configure_logging, span, tracer
+from map_export import build_map_payload
+from model_registry import ModelRegistry
+from pinpoint_pipeline import benchmark, build_pinpoint_pipeline, pipeline_params, pretrain_models
+import json
 import os
 
 st.set_page_config(page_title="PinPoint AI with Kepler.gl", layout="wide")
 st.title("📍 PinPoint AI: Interactive Map with Kepler.gl")
 
+
+@st.cache_resource
+def setup_logging():
+    # Once per server process: the level is global, so it is not a per-session setting
+    configure_logging()
+
+
+setup_logging()
+
 st.sidebar.header("Adjust Parameters")
 percentile = st.sidebar.slider("Population Percentile Threshold", 30, 95, 75, step=5)
 eps_slider = st.sidebar.slider("Clustering Radius (meters)", 50, 500, 100, step=10)
 spider_km = st.sidebar.slider("LRT ↔ Commercial Hub Max Distance (km)", 0.1, 2.0, 0.5, step=0.1)
+hex_resolution = st.sidebar.select_slider("Hex Resolution", options=[5, 6, 7, 8, 9], value=7)
+scorer_labels = {"Threshold rule (fast)": "threshold", "Gradient Boosting": "hist_gradient_boosting",
+                 "Random Forest": "random_forest"}
+scorer = scorer_labels[st.sidebar.selectbox("Suitability Scorer", list(scorer_labels))]
+color_group = st.sidebar.selectbox("Colour Hexbins by Quartile within", ["parlimen", "dun", "state"])
+send_h3 = st.sidebar.checkbox("Send hexbins as H3 ids (smaller map payload)", value=False)
+budget_mb = st.sidebar.number_input("Map payload budget (MB)", min_value=1.0, value=20.0, step=1.0)
 # ----------------------------
 # 🔹 File Paths
 # ----------------------------
@@ -35,121 +50,86 @@ state_geojson = get_file_path("administrative_1_state.geojson")
 poi_csv = get_file_path("FullPOI_with_KLV.csv")
 population_csv = get_file_path("State_1km_pop_data (Cleaned).csv")
 lrt_file = get_file_path("lrt-malaysia.csv")
-commercial_file = get_file_path("Clustered_POIs.csv")
-
-
-# ----------------------------
-# 🔹 Cached Loaders
-# ----------------------------
-@st.cache_data
-def load_data():
-    loader = DataLoader(state_geojson, poi_csv, population_csv)
-    return loader, *loader.load_data()
-
-@st.cache_data
-def train_model(_gdf_population, feature_columns, threshold):
-    y_train = (_gdf_population["population_every_1km2"] > threshold).astype(int)
-    model = RandomForestClassifier(n_estimators=200, random_state=42)
-    model.fit(_gdf_population[feature_columns], y_train)
-    return model
-
-
-loader, gdf_poi, gdf_population, gdf_states = load_data()
-
-# ----------------------------
-# 🔹 Preprocessing & Model
-# ----------------------------
-feature_columns = [
-    "population_every_1km2", "income_avg", "expenditure_avg",
-    "ethnicity_proportion_bumi", "ethnicity_proportion_chinese", "ethnicity_proportion_indian",
-    "age_proportion_0_14", "age_proportion_15_64", "age_proportion_18_above", "age_proportion_65_above"
-]
-gdf_population[feature_columns] = gdf_population[feature_columns].fillna(gdf_population[feature_columns].median())
-threshold = np.percentile(gdf_population["population_every_1km2"], percentile)
-rf_model = train_model(gdf_population, feature_columns, threshold)
-
-# ----------------------------
-# 🔹 Generate Hexbins
-# ----------------------------
-hexgen = HexbinGenerator(loader, rf_model)
-gdf_hex = hexgen.generate_hexbins_with_ml()
-
-gdf_hex = gdf_hex.set_geometry("geometry")
-if gdf_hex.crs is None:
-    gdf_hex.set_crs(epsg=4326, inplace=True)
-else:
-    gdf_hex = gdf_hex.to_crs(epsg=4326)
-
-gdf_hex["type"] = "Hexbin"
-
-gdf_hex = hexgen.assign_colors_by_parlimen(gdf_hex)
-
-# ----------------------------
-# 🔹 POI Filtering
-# ----------------------------
-poi_processor = POIProcessor()
-target_states = ["Selangor", "W.P. Kuala Lumpur", "W.P. Putrajaya"]
-gdf_selected_states = gdf_states[gdf_states["state"].isin(target_states)]
-gdf_poi = poi_processor.filter_pois(gdf_poi, gdf_selected_states)
-gdf_poi = poi_processor.assign_poi_to_hex(gdf_poi)
-
-# ----------------------------
-# 🔹 Reactive Rerun Detection
-# ----------------------------
-if "prev_eps_slider" not in st.session_state:
-    st.session_state.prev_eps_slider = eps_slider
-if "prev_spider_km" not in st.session_state:
-    st.session_state.prev_spider_km = spider_km
-
-rerun_cluster = eps_slider != st.session_state.prev_eps_slider
-rerun_spider = spider_km != st.session_state.prev_spider_km
-
-st.session_state.prev_eps_slider = eps_slider
-st.session_state.prev_spider_km = spider_km
-
-# ----------------------------
-# 🔹 Clustering (If Needed)
-# ----------------------------
-if rerun_cluster or "cluster_polygons" not in st.session_state:
-    eps_degrees = eps_slider / 111000
-    clustering = POIClustering(eps_distance=eps_degrees)
-    gdf_poi = clustering.cluster_pois(gdf_poi)
-    cluster_polygons = clustering.generate_cluster_polygons(gdf_poi, gdf_population)
-    if cluster_polygons is not None and not cluster_polygons.empty:
-        cluster_polygons = cluster_polygons.set_geometry("geometry")
-        cluster_polygons.set_crs(epsg=4326, inplace=True)
-    st.session_state.cluster_polygons = cluster_polygons
-    st.session_state.gdf_poi = gdf_poi
-else:
-    cluster_polygons = st.session_state.cluster_polygons
-    gdf_poi = st.session_state.gdf_poi
-
-# ----------------------------
-# 🔹 Spider Layer (If Needed)
-# ----------------------------
-if rerun_spider or "spider_gdf" not in st.session_state:
-    spider_layer = SpiderMapLayer(lrt_file, commercial_file, max_distance_km=spider_km)
-    spider_layer.load_data()
-    spider_gdf, lrt_points_gdf = spider_layer.generate_spider_outputs()
-    st.session_state.spider_gdf = spider_gdf
-    st.session_state.lrt_points_gdf = lrt_points_gdf
-else:
-    spider_gdf = st.session_state.spider_gdf
-    lrt_points_gdf = st.session_state.lrt_points_gdf
-
-# ----------------------------
-# 🔹 Kepler.gl Display
-# ----------------------------
-kepler_map = KeplerGl(height=1000, width="100%", data={"Hexbins": gdf_hex})
-kepler_map.add_data(data=gdf_hex, name="Hexbins")
-if not gdf_poi.empty:
-    kepler_map.add_data(data=gdf_poi, name="POIs")
-if cluster_polygons is not None and not cluster_polygons.empty:
-    kepler_map.add_data(data=cluster_polygons, name="Clusters")
-if not spider_gdf.empty:
-    kepler_map.add_data(data=spider_gdf, name="LRT Links")
-if not lrt_points_gdf.empty:
-    kepler_map.add_data(data=lrt_points_gdf, name="LRT Stations")
+cache_dir = get_file_path(".cache")  # Columnar cache of parsed datasets
+precomputed_dir = get_file_path("precomputed")  # Artifacts written by batch_precompute.py
+# Processes for per-region clustering/hexbin/spider execution; unset runs them in this process
+parallel_workers = int(os.environ.get("PINPOINT_WORKERS", 0)) or None
+# Aggregate the hex pyramid from the population CSV in chunks instead of the loaded grid
+stream_population = os.environ.get("PINPOINT_STREAM_POPULATION", "0") == "1"
+
+
+# ----------------------------
+# 🔹 Pipeline
+# ----------------------------
+# Datasets are parsed once per process by the shared registry; every rerun gets the same frames.
+loader = DataLoader(state_geojson, poi_csv, population_csv, cache_dir=cache_dir)
+
+@st.cache_resource
+def get_model_registry():
+    model_registry = ModelRegistry(cache_dir)
+    # Fits every percentile slider value in the background
+    pretrain_models(loader, model_registry, stream_population=stream_population)
+    return model_registry
+
+@st.cache_resource
+def get_pipeline():
+    # One stage graph per process: each stage is memoized by the hash of its inputs and parameters,
+    # so a slider change only reruns the stages downstream of it
+    return build_pinpoint_pipeline(loader, lrt_file, cache_dir=cache_dir, model_registry=get_model_registry(),
+                                   parallel_workers=parallel_workers, stream_population=stream_population)
+
+# Every span opened during this rerun is a child of `rerun`, so the trace panel shows this session only
+with span("rerun") as rerun:
+    _, _, gdf_states = loader.load_data(include_population=not stream_population)
+    target_states = st.sidebar.multiselect(
+        "States", sorted(gdf_states["state"].unique()), default=["Selangor", "W.P. Kuala Lumpur", "W.P. Putrajaya"]
+    )
+
+    pipeline = get_pipeline()
+    params = pipeline_params(
+        loader, lrt_file, percentile=percentile, eps_meters=eps_slider, spider_km=spider_km,
+        hex_resolution=hex_resolution, target_states=target_states, scorer=scorer, color_group=color_group
+    )
+    # Standard settings are served from precomputed artifacts (compacted below like fresh layers,
+    # so the payload budget applies); anything else runs the pipeline
+    layers = load_precomputed(precomputed_dir, params, as_payload=False)
+    rerun.set(precomputed=layers is not None)
+    pipeline_run = None
+    if layers is None:
+        pipeline_run = pipeline.run(params)
+        layers = pipeline_run["map"]
+
+    # ----------------------------
+    # 🔹 Kepler.gl Display
+    # ----------------------------
+    # Displayed columns only, rounded coordinates, each dataset sent once and within the byte budget
+    datasets, payload_report = build_map_payload(layers, budget_bytes=int(budget_mb * 1024 * 1024), h3_hexes=send_h3)
+    kepler_map = KeplerGl(height=1000, width="100%", data=datasets)
 
 st.subheader("🗺️ PinPoint AI Map")
 keplergl_static(kepler_map, center_map=True, height=800)
+
+with st.expander("Map payload"):
+    st.dataframe(payload_report)
+    if payload_report.attrs["steps"]:
+        st.caption("Reduced to fit the budget: " + ", ".join(payload_report.attrs["steps"]))
+
+with st.expander("Pipeline stages (last rerun)"):
+    if pipeline_run is None:
+        st.caption("Served from precomputed artifacts.")
+    else:
+        st.dataframe(pipeline.report(pipeline_run))
+
+with st.expander("Stage trace (last rerun)"):
+    st.dataframe(tracer.report(rerun))
+    st.download_button("Download trace (chrome://tracing / Perfetto)",
+                       json.dumps(tracer.chrome_trace(rerun), default=str),
+                       file_name="pinpoint-trace.json", mime="application/json")
+
+with st.expander("Scorer benchmark"):
+    if st.button("Compare scorers on the current hex table"):
+        results = pipeline.run(params, targets=["population", "hex_state_filter"])
+        st.dataframe(benchmark(loader, results["hex_state_filter"], results["population"], percentile, get_model_registry()))
+
+with st.expander("Dataset registry"):
+    st.dataframe(registry.stats())
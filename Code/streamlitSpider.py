@@ -1,65 +1,129 @@
 import pandas as pd
 import numpy as np
-from geopy.distance import geodesic
-from shapely.geometry import LineString, Point
+import shapely
 import geopandas as gpd
+from sklearn.neighbors import BallTree
+
+from data_loader import file_fingerprint
+from dataset_registry import registry
+from instrumentation import count, get_logger, traced
+
+EARTH_RADIUS_KM = 6371.0088
+LINK_COLUMNS = ["hub_id", "station_name", "distance_km"]
+
+logger = get_logger("spider")
+
+
+def radius_join(hub_lat, hub_lon, station_lat, station_lon, max_distance_km, nearest_k=None):
+    """Pair every hub with the stations within ``max_distance_km`` (haversine) in one BallTree query.
+
+    With ``nearest_k`` only the k closest stations inside the radius are kept per hub.
+    Returns aligned arrays ``(hub_idx, station_idx, distance_km)``, closest first per hub
+    (equal distances by station index, so the order does not depend on the tree).
+    """
+    empty = (np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=float))
+    if len(hub_lat) == 0 or len(station_lat) == 0:
+        return empty
+
+    tree = BallTree(np.radians(np.column_stack([station_lat, station_lon])), metric="haversine")
+    hubs = np.radians(np.column_stack([hub_lat, hub_lon]))
+
+    if nearest_k:
+        k = min(nearest_k, len(station_lat))
+        distances, station_idx = tree.query(hubs, k=k)
+        hub_idx = np.repeat(np.arange(len(hubs)), k)
+        station_idx = station_idx.ravel()
+        distance_km = distances.ravel() * EARTH_RADIUS_KM
+        keep = distance_km <= max_distance_km
+        return sort_links(hub_idx[keep], station_idx[keep], distance_km[keep])
+
+    station_lists, distance_lists = tree.query_radius(hubs, r=max_distance_km / EARTH_RADIUS_KM,
+                                                      return_distance=True, sort_results=True)
+    counts = np.array([len(idx) for idx in station_lists], dtype=np.int64)
+    if counts.sum() == 0:
+        return empty
+    hub_idx = np.repeat(np.arange(len(hubs)), counts)
+    return sort_links(hub_idx, np.concatenate(station_lists), np.concatenate(distance_lists) * EARTH_RADIUS_KM)
+
+
+def sort_links(hub_idx, station_idx, distance_km):
+    """Links in hub order, closest station first, equal distances by station index."""
+    order = np.lexsort((station_idx, distance_km, hub_idx))
+    return hub_idx[order], station_idx[order], distance_km[order]
+
 
 class SpiderMapLayer:
-    def __init__(self, lrt_file, commercial_file, max_distance_km=1):
+    def __init__(self, lrt_file, commercial_file=None, max_distance_km=1, nearest_k=None, commercial_hubs=None):
         self.lrt_file = lrt_file
         self.commercial_file = commercial_file
+        self.commercial_hubs = commercial_hubs  # Cluster table from POIClustering, used instead of commercial_file
         self.max_distance_km = max_distance_km
+        self.nearest_k = nearest_k  # Only link each hub to its k closest stations within range
         self.df_lrt = None
         self.df_commercial = None
 
+    @traced("SpiderMapLayer.load_data")
     def load_data(self):
-        """Loads LRT and commercial hub data."""
-        self.df_lrt = pd.read_csv(self.lrt_file, encoding="ISO-8859-1")
-        self.df_commercial = pd.read_csv(self.commercial_file)
+        """Loads LRT and commercial hub data (hubs come from ``commercial_hubs`` when given)."""
+        df_lrt = registry.get(("lrt", self.lrt_file, file_fingerprint(self.lrt_file)),
+                              lambda: pd.read_csv(self.lrt_file, encoding="ISO-8859-1"))
+        if self.commercial_hubs is not None:
+            df_commercial = pd.DataFrame(self.commercial_hubs.drop(columns="geometry", errors="ignore"))
+        elif self.commercial_file:
+            df_commercial = registry.get(("commercial", self.commercial_file, file_fingerprint(self.commercial_file)),
+                                         lambda: pd.read_csv(self.commercial_file))
+        else:
+            raise ValueError("No commercial hubs: pass commercial_file or commercial_hubs.")
 
-        self.df_lrt.rename(columns={'latitude': 'Latitude', 'longitude': 'Longitude'}, inplace=True)
-        self.df_commercial.rename(columns={'Centroid_Lat': 'Latitude', 'Centroid_Lon': 'Longitude'}, inplace=True)
+        # rename() returns new frames, so the shared registry copies stay untouched
+        self.df_lrt = df_lrt.rename(columns={'latitude': 'Latitude', 'longitude': 'Longitude'})
+        self.df_commercial = df_commercial.rename(columns={'Centroid_Lat': 'Latitude', 'Centroid_Lon': 'Longitude'})
 
-        print(f"[SpiderLayer DEBUG] Loaded {len(self.df_lrt)} LRT stations.")
-        print(f"[SpiderLayer DEBUG] Loaded {len(self.df_commercial)} commercial hubs.")
+        count("stations", len(self.df_lrt))
+        count("hubs", len(self.df_commercial))
+        logger.debug(f"Loaded {len(self.df_lrt)} LRT stations and {len(self.df_commercial)} commercial hubs.")
 
-    def generate_spider_outputs(self):
+    @traced("SpiderMapLayer.generate_spider_outputs")
+    def generate_spider_outputs(self, join=radius_join):
         """
+        ``join`` pairs hubs with stations and must behave like ``radius_join`` (e.g. the
+        region-partitioned ``parallel_regions.partitioned_radius_join``).
+
         Generates:
-        - Spider links (GeoDataFrame of LineStrings)
+        - Spider links (GeoDataFrame of LineStrings with hub_id, station_name and distance_km)
         - LRT station markers (GeoDataFrame of Points)
         :return: (GeoDataFrame, GeoDataFrame)
         """
         if self.df_lrt is None or self.df_commercial is None:
             raise ValueError("Data not loaded. Call load_data() first.")
 
-        spider_lines = []
+        logger.debug(f"Generating spider links with max distance {self.max_distance_km} km...")
 
-        print(f"[SpiderLayer DEBUG] Generating spider links with max distance {self.max_distance_km} km...")
-
-        for _, com_row in self.df_commercial.iterrows():
-            com_point = (com_row["Latitude"], com_row["Longitude"])
-            found_connection = False
-
-            for _, lrt_row in self.df_lrt.iterrows():
-                lrt_point = (lrt_row["Latitude"], lrt_row["Longitude"])
-                distance_km = geodesic(com_point, lrt_point).km
-
-                if distance_km <= self.max_distance_km:
-                    line = LineString([
-                        (com_row["Longitude"], com_row["Latitude"]),
-                        (lrt_row["Longitude"], lrt_row["Latitude"])
-                    ])
-                    spider_lines.append(line)
-                    found_connection = True
+        hub_idx, station_idx, distance_km = join(
+            self.df_commercial["Latitude"].to_numpy(dtype=float), self.df_commercial["Longitude"].to_numpy(dtype=float),
+            self.df_lrt["Latitude"].to_numpy(dtype=float), self.df_lrt["Longitude"].to_numpy(dtype=float),
+            self.max_distance_km, nearest_k=self.nearest_k
+        )
 
-            if not found_connection:
-                print(f"[SpiderLayer DEBUG] ❌ No nearby LRT for commercial hub at {com_point}")
+        unconnected = len(self.df_commercial) - len(np.unique(hub_idx))
+        count("links", len(hub_idx))
+        count("unconnected_hubs", unconnected)
+        if unconnected:
+            logger.debug(f"❌ {unconnected} commercial hubs have no LRT within {self.max_distance_km} km")
+        logger.info(f"✅ Total spider links generated: {len(hub_idx)}")
 
-        print(f"[SpiderLayer DEBUG] ✅ Total spider links generated: {len(spider_lines)}")
+        hub_xy = self.df_commercial[["Longitude", "Latitude"]].to_numpy(dtype=float)
+        station_xy = self.df_lrt[["Longitude", "Latitude"]].to_numpy(dtype=float)
+        hub_ids = (self.df_commercial["Cluster_ID"] if "Cluster_ID" in self.df_commercial.columns
+                   else self.df_commercial.index.to_series()).to_numpy()
 
-        spider_gdf = gpd.GeoDataFrame(geometry=spider_lines, crs="EPSG:4326") if spider_lines else \
-                     gpd.GeoDataFrame(columns=["geometry"], geometry=[], crs="EPSG:4326")
+        links = pd.DataFrame({
+            "hub_id": hub_ids[hub_idx],
+            "station_name": self.df_lrt["station_name"].to_numpy()[station_idx],
+            "distance_km": distance_km
+        }, columns=LINK_COLUMNS)
+        lines = shapely.linestrings(np.stack([hub_xy[hub_idx], station_xy[station_idx]], axis=1)) if len(links) else []
+        spider_gdf = gpd.GeoDataFrame(links, geometry=lines, crs="EPSG:4326")
 
         # LRT station points
         lrt_points = gpd.GeoDataFrame(
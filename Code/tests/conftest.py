@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules live flat in Code/ and import each other by name
+CODE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATASET_DIR = os.path.join(os.path.dirname(CODE_DIR), "Dataset")
+sys.path.insert(0, CODE_DIR)
@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+gpd = pytest.importorskip("geopandas")
+sklearn_cluster = pytest.importorskip("sklearn.cluster")
+from sklearn.metrics import adjusted_rand_score
+
+from conftest import DATASET_DIR
+from streamlitDBSCAN import EARTH_RADIUS_M, POIClustering, neighbor_graph
+
+POI_CSV = os.path.join(DATASET_DIR, "FullPOI_with_KLV.csv")
+
+
+@pytest.fixture(scope="module")
+def gdf_poi():
+    if not os.path.exists(POI_CSV):
+        pytest.skip("POI dataset not available")
+    df = pd.read_csv(POI_CSV, usecols=["Latitude", "Longitude"], encoding="latin-1").dropna()
+    return gpd.GeoDataFrame(geometry=gpd.points_from_xy(df["Longitude"], df["Latitude"]), crs="EPSG:4326")
+
+
+def haversine_dbscan(gdf, eps_meters, min_samples=3):
+    """Reference: scikit-learn's own haversine DBSCAN over all points."""
+    coords = np.radians(np.column_stack([gdf.geometry.y, gdf.geometry.x]))
+    return sklearn_cluster.DBSCAN(eps=eps_meters / EARTH_RADIUS_M, min_samples=min_samples,
+                                  metric="haversine").fit_predict(coords)
+
+
+@pytest.mark.parametrize("eps_meters", [50, 100, 230, 500])
+def test_cached_graph_matches_haversine_dbscan(gdf_poi, eps_meters):
+    # The graph is built at 500 m once and masked down for smaller radii
+    labels = POIClustering(eps_meters=eps_meters, max_eps_meters=500, output_csv=None).cluster_pois(
+        gdf_poi.copy())["cluster"].to_numpy()
+    expected = haversine_dbscan(gdf_poi, eps_meters)
+    np.testing.assert_array_equal(labels == -1, expected == -1)
+    assert adjusted_rand_score(labels, expected) == 1.0
+
+
+def test_duplicate_points_keep_explicit_zero_distances():
+    lat = np.array([3.1, 3.1, 3.1, 3.2])
+    lon = np.array([101.6, 101.6, 101.6, 101.7])
+    graph = neighbor_graph(lat, lon, 100).within(50)
+    assert graph[0].nnz == 3  # Itself and both duplicates, all at distance 0
+
+    gdf = gpd.GeoDataFrame(geometry=gpd.points_from_xy(lon, lat), crs="EPSG:4326")
+    labels = POIClustering(eps_meters=50, max_eps_meters=100, output_csv=None).cluster_pois(gdf)["cluster"]
+    assert list(labels) == [0, 0, 0, -1]
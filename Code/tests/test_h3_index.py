@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+h3 = pytest.importorskip("h3")
+
+from h3_index import MultiResolutionIndex, latlng_to_cells
+
+
+def _random_points(n=5000, seed=0):
+    rng = np.random.default_rng(seed)
+    lat = rng.uniform(2.6, 3.9, n).round(4)  # Rounded, so some coordinates repeat
+    lng = rng.uniform(100.8, 102.0, n).round(4)
+    return lat, lng
+
+
+@pytest.mark.parametrize("resolution", [5, 6, 7, 8, 9])
+def test_multi_resolution_index_matches_latlng_to_cell(resolution):
+    lat, lng = _random_points()
+    index = MultiResolutionIndex(lat, lng, resolutions=(5, 6, 7, 8, 9))
+    expected = [h3.latlng_to_cell(a, b, resolution) for a, b in zip(lat, lng)]
+    assert list(index.cells(resolution)) == expected
+
+
+def test_latlng_to_cells_matches_latlng_to_cell():
+    lat, lng = _random_points(1000, seed=1)
+    expected = [h3.latlng_to_cell(a, b, 7) for a, b in zip(lat, lng)]
+    assert list(latlng_to_cells(lat, lng, 7)) == expected
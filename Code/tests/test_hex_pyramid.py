@@ -0,0 +1,60 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+h3 = pytest.importorskip("h3")
+gpd = pytest.importorskip("geopandas")
+
+from conftest import DATASET_DIR
+from data_loader import POPULATION_COLUMNS, DataLoader
+from hex_pyramid import HEX_AGGREGATIONS, HexPyramid, aggregate_cells, finalize, merge_partials
+
+POPULATION_CSV = os.path.join(DATASET_DIR, "State_1km_pop_data (Cleaned).csv")
+RESOLUTIONS = (5, 6, 7, 8, 9)
+
+
+@pytest.fixture(scope="module")
+def gdf_population():
+    if not os.path.exists(POPULATION_CSV):
+        pytest.skip("population grid not available")
+    df = pd.read_csv(POPULATION_CSV, usecols=POPULATION_COLUMNS)
+    return gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df["Lon"], df["Lat"]), crs="EPSG:4326")
+
+
+def baseline(gdf_population, resolution):
+    """The original row-wise aggregation of the hexbin layer."""
+    hex_ids = [h3.latlng_to_cell(lat, lon, resolution) for lat, lon in zip(gdf_population["Lat"], gdf_population["Lon"])]
+    return gdf_population.assign(hex=hex_ids).groupby("hex").agg(HEX_AGGREGATIONS).reset_index()
+
+
+@pytest.fixture(scope="module")
+def pyramid(gdf_population):
+    return HexPyramid("test", resolutions=RESOLUTIONS).build(gdf_population)
+
+
+@pytest.mark.parametrize("resolution", RESOLUTIONS)
+def test_pyramid_levels_match_groupby(gdf_population, pyramid, resolution):
+    pd.testing.assert_frame_equal(pyramid.level(resolution), baseline(gdf_population, resolution),
+                                  check_dtype=False, rtol=1e-9)
+
+
+def test_merged_chunks_match_single_partial(gdf_population):
+    cells = np.array([h3.latlng_to_cell(lat, lon, 7) for lat, lon in zip(gdf_population["Lat"], gdf_population["Lon"])],
+                     dtype=object)
+    half = len(gdf_population) // 2
+    chunks = [aggregate_cells(gdf_population.iloc[:half], cells[:half]),
+              aggregate_cells(gdf_population.iloc[half:], cells[half:], row_offset=half)]
+    pd.testing.assert_frame_equal(finalize(merge_partials(chunks)), finalize(aggregate_cells(gdf_population, cells)),
+                                  check_dtype=False, rtol=1e-9)
+
+
+def test_streamed_pyramid_matches_build(gdf_population, pyramid):
+    loader = DataLoader(None, population_csv=POPULATION_CSV)
+    # Small chunks, so several merges of chunk partials happen
+    streamed = loader.stream_population_pyramid(resolutions=RESOLUTIONS, chunksize=max(1, len(gdf_population) // 40))
+    for resolution in RESOLUTIONS:
+        # Streamed values are read as float32
+        pd.testing.assert_frame_equal(streamed.level(resolution), pyramid.level(resolution),
+                                      check_dtype=False, rtol=1e-5)
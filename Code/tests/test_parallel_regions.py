@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+gpd = pytest.importorskip("geopandas")
+pytest.importorskip("h3")
+pytest.importorskip("sklearn")
+from sklearn.metrics import adjusted_rand_score
+from sklearn.neighbors import BallTree
+
+from h3_index import latlng_to_cells
+from parallel_regions import (HALO_FACTOR, PARTITION_RESOLUTION, cluster_pois_partitioned, halo_members,
+                              partitioned_radius_join)
+from streamlitDBSCAN import EARTH_RADIUS_M, POIClustering
+from streamlitSpider import radius_join
+
+MAX_WORKERS = 2
+
+
+def _clustered_points(n_clusters=40, per_cluster=500, n_noise=5000, seed=0):
+    """Dense blobs spread over several partition cells (so some straddle a border), plus uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers_lat = rng.uniform(2.6, 3.9, n_clusters)
+    centers_lon = rng.uniform(100.8, 102.0, n_clusters)
+    lat = np.concatenate([rng.normal(centers_lat, 0.003, (per_cluster, n_clusters)).ravel(),
+                          rng.uniform(2.6, 3.9, n_noise)])
+    lon = np.concatenate([rng.normal(centers_lon, 0.003, (per_cluster, n_clusters)).ravel(),
+                          rng.uniform(100.8, 102.0, n_noise)])
+    return lat, lon
+
+
+@pytest.fixture(scope="module")
+def points():
+    return _clustered_points()
+
+
+@pytest.mark.parametrize("eps_meters", [50, 100, 230])
+def test_partitioned_clustering_matches_serial(points, eps_meters):
+    lat, lon = points
+    gdf = gpd.GeoDataFrame(geometry=gpd.points_from_xy(lon, lat), crs="EPSG:4326")
+    serial = POIClustering(eps_meters=eps_meters, max_eps_meters=500, output_csv=None)
+    expected = serial.cluster_pois(gdf.copy())["cluster"].to_numpy()
+    labels = cluster_pois_partitioned(gdf.copy(), eps_meters, max_eps_meters=500,
+                                      max_workers=MAX_WORKERS)["cluster"].to_numpy()
+
+    assert len(set(latlng_to_cells(lat, lon, PARTITION_RESOLUTION))) > 1
+    np.testing.assert_array_equal(labels == -1, expected == -1)
+    # Border points reachable from two clusters may go to either, as in DBSCAN itself
+    core = serial.core_mask
+    assert adjusted_rand_score(labels[core], expected[core]) == 1.0
+
+
+def test_halo_members_hold_every_neighbour_of_home_points(points):
+    lat, lon = points
+    eps_meters = 230
+    home = latlng_to_cells(lat, lon, PARTITION_RESOLUTION)
+    members = halo_members(lat, lon, home, HALO_FACTOR * eps_meters)
+
+    coords = np.radians(np.column_stack([lat, lon]))
+    neighbours = BallTree(coords, metric="haversine").query_radius(coords, r=eps_meters / EARTH_RADIUS_M)
+    for cell, member_idx in members.items():
+        assert np.all(np.diff(member_idx) > 0)
+        home_idx = np.flatnonzero(home == cell)
+        if not len(home_idx):
+            continue  # A halo-only cell, which no point calls home
+        assert np.isin(home_idx, member_idx).all()
+        needed = np.unique(np.concatenate([neighbours[i] for i in home_idx]))
+        assert np.isin(needed, member_idx).all()
+
+
+@pytest.mark.parametrize("nearest_k", [None, 3])
+def test_partitioned_radius_join_matches_serial(points, nearest_k):
+    lat, lon = points
+    rng = np.random.default_rng(1)
+    hubs = rng.choice(len(lat), 2000, replace=False)
+    station_lat = rng.uniform(2.6, 3.9, 300)
+    station_lon = rng.uniform(100.8, 102.0, 300)
+
+    expected = radius_join(lat[hubs], lon[hubs], station_lat, station_lon, 5, nearest_k)
+    result = partitioned_radius_join(lat[hubs], lon[hubs], station_lat, station_lon, 5, nearest_k,
+                                     max_workers=MAX_WORKERS)
+    assert len(expected[0]) > 0
+    for actual, wanted in zip(result, expected):
+        np.testing.assert_array_equal(actual, wanted)